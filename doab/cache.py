@@ -0,0 +1,133 @@
+"""
+On-disk caches for downloaded blobs and intermediate results
+"""
+import hashlib
+import logging
+import os
+import threading
+
+import orjson
+
+from doab import const
+
+logger = logging.getLogger(__name__)
+
+# Response headers we store and the request headers used to revalidate them
+VALIDATORS = (
+    ("ETag", "If-None-Match"),
+    ("Last-Modified", "If-Modified-Since"),
+)
+
+
+def fetch_cached(session, url, cache_dir=const.DEFAULT_CACHE_DIR):
+    """ Fetches the body for the given URL, revalidating any cached copy
+
+    Bodies are stored under the sha256 of the URL alongside a `.meta` file
+    with the validators returned by the server. When those are available, a
+    conditional request is issued and a `304 Not Modified` is served from disk
+    :param session: A `requests.Session` used to issue the request
+    :param url: The URL to fetch
+    :param cache_dir: The directory where the cached responses are stored
+    :return: The response body as `bytes`
+    """
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    body_path = os.path.join(cache_dir, key)
+    meta_path = f"{body_path}.meta"
+
+    headers = {}
+    if os.path.exists(body_path) and os.path.exists(meta_path):
+        with open(meta_path, "rb") as meta_file:
+            meta = orjson.loads(meta_file.read())
+        for header, conditional_header in VALIDATORS:
+            if meta.get(header):
+                headers[conditional_header] = meta[header]
+
+    response = session.get(url, headers=headers)
+    if response.status_code == 304:
+        logger.debug(f"Serving {url} from cache")
+        with open(body_path, "rb") as body_file:
+            return body_file.read()
+    elif not response.ok:
+        response.raise_for_status()
+
+    meta = {
+        header: response.headers[header]
+        for header, _ in VALIDATORS
+        if header in response.headers
+    }
+    if meta:
+        _write(body_path, response.content, mode="wb")
+        _write(meta_path, orjson.dumps(meta), mode="wb")
+
+    return response.content
+
+
+def load(key, cache_dir=const.DEFAULT_CACHE_DIR):
+    """ Loads an object stored with `store`
+    :param key: A filename safe `str` identifying the object
+    :return: The deserialised object or `None` if it is not cached
+    """
+    path = os.path.join(cache_dir, f"{key}.json")
+    try:
+        with open(path, "rb") as cached_file:
+            return orjson.loads(cached_file.read())
+    except FileNotFoundError:
+        return None
+
+
+def store(key, obj, cache_dir=const.DEFAULT_CACHE_DIR):
+    """ Stores a JSON serialisable object under the given key
+    :param key: A filename safe `str` identifying the object
+    :param obj: The object to be stored
+    """
+    path = os.path.join(cache_dir, f"{key}.json")
+    _write(path, orjson.dumps(obj), mode="wb")
+
+
+# Serialises appends to logs from the threads of this process
+_log_lock = threading.Lock()
+
+
+def load_log(name, cache_dir=const.DEFAULT_CACHE_DIR):
+    """ Loads the records appended to a log with `append_log`
+    :param name: A filename safe `str` identifying the log
+    :return: A list of the deserialised records, oldest first
+    """
+    path = os.path.join(cache_dir, f"{name}.jsonl")
+    records = []
+    try:
+        with open(path, "rb") as log_file:
+            for line in log_file:
+                try:
+                    records.append(orjson.loads(line))
+                except orjson.JSONDecodeError:
+                    # e.g. a line torn by an interrupted append
+                    logger.warning(f"Skipping invalid record in {path}")
+    except FileNotFoundError:
+        pass
+    return records
+
+
+def append_log(name, records, cache_dir=const.DEFAULT_CACHE_DIR):
+    """ Appends JSON serialisable records to a log, one per line
+    :param name: A filename safe `str` identifying the log
+    :param records: An iterable of records
+    """
+    to_write = b"".join(orjson.dumps(record) + b"\n" for record in records)
+    if not to_write:
+        return
+    path = os.path.join(cache_dir, f"{name}.jsonl")
+    os.makedirs(cache_dir, exist_ok=True)
+    with _log_lock, open(path, "ab") as log_file:
+        log_file.write(to_write)
+
+
+def _write(path, to_write, mode):
+    """ Writes via a temporary file so concurrent readers never see partial
+    files
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, mode) as tmp_file:
+        tmp_file.write(to_write)
+    os.replace(tmp_path, path)
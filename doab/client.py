@@ -51,16 +51,15 @@ class DOABRecord():
         # identifier header format is 'oai:doab-books:{id}'
         self.doab_id = record.header.identifier.split(":")[-1]
         self.identifiers = filter(is_uri, record.metadata["identifier"])
-        extractors = [
-            extractor.from_identifier(self, identifier, self.metadata)
-            for identifier in self.identifiers
-            for extractor in CORPUS_EXTRACTORS
-        ]
-        self.extractors = [
-            extractor
-            for extractor in extractors
-            if extractor is not None
-        ]
+        self.extractors = []
+        for identifier in self.identifiers:
+            for extractor_class in CORPUS_EXTRACTORS:
+                extractor = extractor_class.from_identifier(
+                    self, identifier, self.metadata)
+                if extractor is not None:
+                    self.extractors.append(extractor)
+                    if extractor.exclusive:
+                        break
 
         # some extractors do not want to be called more than once with different identifiers
         # the allow_multiple variable allows them to register this and the below removes
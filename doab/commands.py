@@ -1,10 +1,12 @@
 from concurrent.futures import ThreadPoolExecutor
 from functools import partial
-from itertools import islice
-import json
+from itertools import groupby, islice
 import logging
+from operator import itemgetter
 import os
 
+import orjson
+from sqlalchemy.orm import selectinload
 from sqlalchemy.orm.exc import NoResultFound
 from unidecode import unidecode
 
@@ -12,8 +14,8 @@ from doab import const
 from doab.client import DOABOAIClient
 from doab.db import models, session_context, get_engine
 from doab.files import FileManager
-from doab.reference_matching import match
-from doab.parsing import get_parser_by_name, PARSERS
+from doab.reference_matching import match, match_reference_ids, parse_fields
+from doab.parsing import get_parser_by_name, run_miners_parallel, PARSERS
 from doab import tasker
 
 logger = logging.getLogger(__name__)
@@ -69,11 +71,11 @@ def db_populator(input_path, book_ids=None, workers=0):
 
 def populate_db(book_id, reader):
         try:
-            raw_metadata = reader.read(str(book_id), "metadata.json")
+            raw_metadata = reader.read(str(book_id), "metadata.json", mode="b")
         except FileNotFoundError as e:
             logger.error(e)
             return
-        metadata = json.loads(raw_metadata)
+        metadata = orjson.loads(raw_metadata)
         upsert_book(book_id, metadata)
 
 
@@ -89,28 +91,53 @@ def upsert_book(book_id, metadata):
             session.add(book)
 
         book.update_with_metadata(metadata)
-        if metadata["creator"]:
-            for author_str in metadata["creator"]:
-                author = upsert_author(session, author_str)
+        author_strs = metadata["creator"] or []
+        # Existing authors and identifiers are loaded with a query each
+        known_authors = {
+            author.standarised_name: author
+            for author in session.query(models.Author).filter(
+                models.Author.standarised_name.in_([
+                    process_author_str(author_str)[0]
+                    for author_str in author_strs
+                ])
+            )
+        }
+        book_authors = set(book.authors)
+        for author_str in author_strs:
+            author = upsert_author(session, author_str, known_authors)
+            if author not in book_authors:
                 book.authors.append(author)
+                book_authors.add(author)
+        known_identifiers = {
+            identifier.value: identifier
+            for identifier in session.query(models.Identifier).filter(
+                models.Identifier.value.in_(metadata["identifier"]))
+        }
         for identifier_str in metadata["identifier"]:
-            identifier = upsert_identifier(session, identifier_str)
+            identifier = upsert_identifier(
+                session, identifier_str, known_identifiers)
             identifier.book = book
         session.commit()
 
 
-def upsert_author(session, author_str):
+def upsert_author(session, author_str, known=None):
     """ Updates/Inserts authors to the database from the doab creator string
 
     :param author: A doab formatterdauthor string ("last names, names")
+    :param known: A `dict` of the authors already loaded by standarised name,
+        which is used instead of querying them. New authors are added to it
     """
     standarised, first, middle, last, reference = process_author_str(author_str)
-    try:
-        author = session.query(
-            models.Author
-        ).filter(models.Author.standarised_name == standarised).one()
-    except NoResultFound:
-        author = models.Author(standarised_name=standarised)
+    if known is None:
+        known = {
+            author.standarised_name: author
+            for author in session.query(models.Author).filter(
+                models.Author.standarised_name == standarised)
+        }
+    author = known.get(standarised)
+    if author is None:
+        author = known[standarised] = models.Author(
+            standarised_name=standarised)
     author.first_name = first
     author.middle_name = middle
     author.last_name = last
@@ -144,53 +171,51 @@ def process_author_str(author):
     return standarised_name, first_name, middle_name, last_name, reference_name
 
 
-def upsert_identifier(session, identifier_str):
+def upsert_identifier(session, identifier_str, known=None):
     """ Updates/Inserts an identifier from its DOAB identifier string
 
     :param identifier: string
+    :param known: A `dict` of the identifiers already loaded by value, which
+        is used instead of querying them. New identifiers are added to it
     """
-    try:
-        identifier = session.query(
-            models.Identifier
-        ).filter(models.Identifier.value == identifier_str).one()
-    except NoResultFound:
-        identifier = models.Identifier(value=identifier_str)
+    if known is None:
+        known = {
+            identifier.value: identifier
+            for identifier in session.query(models.Identifier).filter(
+                models.Identifier.value == identifier_str)
+        }
+    identifier = known.get(identifier_str)
+    if identifier is None:
+        identifier = known[identifier_str] = models.Identifier(
+            value=identifier_str)
     return identifier
 
 
 def nuke_citations(book_ids=None):
     with session_context() as session:
-        if not book_ids:
-            books = session.query(models.Book).all()
-            for book in books:
-                try:
-                    for reference in book.references:
-                        for parsed_ref in reference.parsed_references:
-                            session.delete(parsed_ref)
-                        session.delete(reference)
-
-                    session.commit()
-                    print(f'Nuked references for book {book.doab_id}')
-                except NoResultFound:
-                    logger.error(f'Error retrieving book {book.doab_id}.')
-        else:
-
-            for book_id in book_ids:
-                # fetch book metadata
-                try:
-                    book = session.query(
-                        models.Book
-                    ).filter(models.Book.doab_id == str(book_id)).one()
-
-                    for reference in book.references:
-                        for parsed_ref in reference.parsed_references:
-                            session.delete(parsed_ref)
-                        session.delete(reference)
+        books = session.query(models.Book.doab_id)
+        if book_ids:
+            book_ids = {str(book_id) for book_id in book_ids}
+            books = books.filter(models.Book.doab_id.in_(book_ids))
+        nuked_ids = [book_id for book_id, in books]
+        for book_id in (book_ids or set()) - set(nuked_ids):
+            logger.error(f'Error retrieving book {book_id}.')
 
-                    session.commit()
-                    print(f'Nuked references for book {book.doab_id}')
-                except NoResultFound:
-                    logger.error(f'Error retrieving book {book_id}.')
+        # The references of all the books are loaded at once, along with the
+        # links to their books so those can be deleted too
+        references = session.query(models.Reference).join(
+            models.Reference.books
+        ).filter(
+            models.Book.doab_id.in_(nuked_ids)
+        ).options(selectinload(models.Reference.books))
+        for reference in references:
+            for parsed_ref in reference.parsed_references:
+                session.delete(parsed_ref)
+            session.delete(reference)
+        # A single transaction (and fsync) for all the books
+        session.commit()
+        for book_id in nuked_ids:
+            print(f'Nuked references for book {book_id}')
 
 
 def print_citations(book_ids=None):
@@ -212,10 +237,51 @@ def parse_references(input_path, book_ids=None, workers=0, dry_run=False):
     if not book_ids:
         book_ids = list_extracted_books(input_path)
     msg = "Parsing book"
-    tasker.run(parse_reference, book_ids, msg, workers, input_path, dry_run)
-
+    if not workers:
+        tasker.run(parse_reference, book_ids, msg, workers, input_path, dry_run)
+        return
+
+    # Finding references is CPU bound, so it runs across processes. Each book
+    # is parsed in a thread as soon as all its references have been found,
+    # while the rest of the books are still being searched
+    pending = [str(book_id) for book_id in book_ids]
+    total_books = len(pending)
+    futures = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def submit(book_id, found=None):
+            log_msg = f"[task:{total_books - len(pending)}/{total_books}] {msg} {book_id}"
+            futures[book_id] = executor.submit(
+                tasker.task_wrapper, parse_reference, log_msg,
+                book_id, input_path, dry_run, found,
+            )
 
-def parse_reference(book_id, input_path, dry_run=False):
+        with session_context() as session:
+            books = session.query(
+                models.Book
+            ).filter(models.Book.doab_id.in_(pending))
+            # Jobs are returned in order, so the miners of a book are adjacent
+            for book_id, results in groupby(
+                run_miners_parallel(books, input_path, workers),
+                key=itemgetter(1),
+            ):
+                pending.remove(book_id)
+                submit(book_id, {
+                    (miner, book_id): references
+                    for miner, book_id, references in results
+                })
+        # Books without miners are reported by parse_reference
+        while pending:
+            submit(pending.pop())
+    for book_id, future in futures.items():
+        if future.exception():
+            logger.error(
+                f"{msg} {book_id} failed", exc_info=future.exception())
+
+
+def parse_reference(book_id, input_path, dry_run=False, found=None):
+    """ Runs the miners that can handle the given book
+    :param found: A mapping of (miner, book_id) to references already found
+    """
     path = os.path.join(input_path, str(book_id))
 
     with session_context() as session:
@@ -232,10 +298,13 @@ def parse_reference(book_id, input_path, dry_run=False):
                     for parser in parsers:
                         logger.debug("Running parser {0} for book {1}.".format(parser, book_id))
                         parser_for_book = parser(book_id, path)
+                        if found:
+                            parser_for_book.references = found.get(
+                                (parser, str(book_id)), {})
                         if dry_run:
                             parser_for_book.run()
                         else:
-                            parser_for_book.run(session)
+                            parser_for_book.run(session, commit=False)
                 else:
                     logger.debug(f'No appropriate parser found for {book_id}.')
 
@@ -245,6 +314,11 @@ def parse_reference(book_id, input_path, dry_run=False):
         except FileNotFoundError as e:
             logger.debug(f"No book.epub available: {e}")
 
+        # A single transaction for all the miners of the book, including
+        # those that ran before a file was found missing
+        if not dry_run:
+            session.commit()
+
 
 def list_references(book_id):
     with session_context() as session:
@@ -264,13 +338,23 @@ def list_references(book_id):
 
 
 def match_reference(reference=None, parser='Cermine'):
-    parser_class = get_parser_by_name(parser)
+    try:
+        parser_class = get_parser_by_name(parser)
+    except KeyError:
+        logger.error(f"Unknown parser '{parser}'")
+        return {}
 
     clean = parser_class.clean(reference)
     parsed_reference = parser_class.parse_reference(clean)
+    if not parsed_reference:
+        logger.error(f"{parser} could not parse '{reference}'")
+        return {}
 
     with session_context() as session:
-        matches = {book.doab_id: book for book in match(parsed_reference, session)}
+        matches = {
+            book.doab_id: book
+            for book in match(parsed_reference.to_dict(), session)
+        }
         print(f"Matched {len(matches)} books referencing the same citation")
         for i, matched in enumerate(matches.values(), 1):
             print (f"{i}. {matched.doab_id} - {matched.title}")
@@ -339,11 +423,10 @@ def intersect_reference(reference_id, dry_run=None, book_ids=None):
             models.ParsedReference.reference_id == reference_id,
         )
 
-        for parse in parses:
-            logger.debug(f"Matching with {parse.parser} parser")
-            references_matched |= set(
-                match(parse, session, return_references=True, book_ids=book_ids)
-            )
+        for matched in match_reference_ids(
+            [parse_fields(parse) for parse in parses], session, book_ids,
+        ):
+            references_matched |= matched
 
         references = session.query(
             models.Reference,
@@ -356,7 +439,8 @@ def intersect_reference(reference_id, dry_run=None, book_ids=None):
         if dry_run:
             return tuple(
                 (reference.id, [book.doab_id for book in reference.books])
-                for reference in references
+                for reference in references.options(
+                    selectinload(models.Reference.books))
                 if len(reference.books) > 1
             )
         else:
@@ -2,15 +2,25 @@ import logging
 import threading
 
 import requests
+from requests.adapters import HTTPAdapter
 
 logger = logging.getLogger(__name__)
 _threadlocal = threading.local()
 
+# Connection pools shared by the sessions of every thread, so that
+# connections (and their TLS handshakes) outlive the short lived threads of
+# the per book executors
+HTTP_POOL_MAXSIZE = 32
+_http_adapter = HTTPAdapter(pool_maxsize=HTTP_POOL_MAXSIZE)
+
 def get_http_session():
     """ A thread-safe wrapper for requests.session"""
     try:
         return _threadlocal.session
     except AttributeError:
         logger.debug("Starting new HTTP Session")
-        _threadlocal.session = requests.Session()
+        session = requests.Session()
+        session.mount("https://", _http_adapter)
+        session.mount("http://", _http_adapter)
+        _threadlocal.session = session
         return get_http_session()
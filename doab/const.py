@@ -8,6 +8,11 @@ from crossref.restful import Etiquette
 
 # Search weights
 MIN_TITLE_THRESHOLD = 0.25
+# Similarity from which pg_trgm's `%` operator returns candidate titles
+MIN_TITLE_SIMILARITY = 0.3
+# Titles shorter or longer than this ratio are unlikely to be similar enough
+# for MIN_TITLE_SIMILARITY and are filtered out early
+MIN_TITLE_LENGTH_RATIO = MIN_TITLE_SIMILARITY
 MIN_AUTHOR_THRESHOLD = 1/2
 
 CROSSREF_ETIQUETTE = Etiquette('Jisc DOAB Experiment', 'v1.0', 'https://www.jisc.ac.uk/rd/projects/open-metrics-lab',
@@ -19,9 +24,10 @@ DOAB_OAI_ENDPOINT = DOAB_URL + "/oai"
 
 # https://www.crossref.org/blog/dois-and-matching-regular-expressions/
 # 'for the 74.9M DOIs we have seen this matches 74.4M of them'
-DOI_RE = re.compile(r"10.\d{4,9}/[-._;()/:A-Z0-9]+", re.IGNORECASE)
+DOI_RE = re.compile(r"10\.\d{4,9}/[-._;()/:A-Z0-9]+", re.IGNORECASE)
 
 DEFAULT_OUT_DIR = os.getenv("DOAB_DEFAULT_OUT_DIR", "volumes/out")
+DEFAULT_CACHE_DIR = os.getenv("DOAB_CACHE_DIR", "volumes/cache")
 
 RECOGNIZED_BOOK_TYPES = {
     'epub': 'book.epub',
@@ -1,18 +1,38 @@
+from functools import lru_cache
 import logging
-import json
 import re
+
+import orjson
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 
 from doab import const
+from doab.cache import fetch_cached
 from doab.concurrency import get_http_session
 
+__all__ = ["CORPUS_EXTRACTORS", "is_isbn"]
+
 logger = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=4096)
+def _head_content_type(url):
+    """ Returns the content type advertised for the given URL
+
+    Memoized so that an identifier is only probed once per process
+    :param url: The URL to be probed with a HEAD request
+    :return: The `content-type` header as a `str` or `None`
+    """
+    response = get_http_session().head(url, allow_redirects=True, timeout=10)
+    return response.headers.get("content-type")
+
+
 class BaseExtractor():
 
     allow_multiple = True
+    # When an exclusive extractor handles an identifier, no other extractors
+    # are probed for it (saving the HEAD requests of MIME based extractors)
+    exclusive = False
     IDENTIFIER = 'BaseExtractor'
 
     """ A Base class for extracting content"""
@@ -68,11 +88,7 @@ class HTTPCorpusExtractorMixin(BaseCorpusExtractor):
         self._session = get_http_session()
 
     def _fetch(self, uri):
-        response = self._session.get(uri)
-        if response.ok:
-            return(response.content)
-        else:
-            response.raise_for_status()
+        return fetch_cached(self._session, uri)
 
 
 class MimeBasedCorpusExtractor(BaseCorpusExtractor):
@@ -82,22 +98,18 @@ class MimeBasedCorpusExtractor(BaseCorpusExtractor):
 
     @classmethod
     def validate_identifier(cls, identifier, doab_record):
-        session = requests.session()
-        content_type = session.head(identifier).headers.get("content-type")
+        content_type = _head_content_type(identifier)
         if content_type == cls.CONTENT_TYPE:
             return True
         return False
 
     def extract(self):
-        response = requests.get(self.identifier)
-        if response.status_code == 200:
-            yield (self.FILE_LABEL, response.content)
-        else:
-            raise response.raise_for_status()
+        yield (self.FILE_LABEL, fetch_cached(get_http_session(), self.identifier))
 
 
 class JSONMetadataExtractor(BaseCorpusExtractor):
     IDENTIFIER = 'JSONMetadataExtractor'
+    exclusive = True
     METADATA_KEYS = {
         "title", "identifier", "creator",
         "language", "publisher", "date",
@@ -119,7 +131,7 @@ class JSONMetadataExtractor(BaseCorpusExtractor):
             return None
 
         description = "\n".join(metadata["description"])
-        matches  = re.findall(const.DOI_RE, description)
+        matches  = const.DOI_RE.findall(description)
         if not matches:
             doi = None
         elif len(matches) == 1:
@@ -135,9 +147,8 @@ class JSONMetadataExtractor(BaseCorpusExtractor):
             key: self.record.metadata.get(key)
             for key in self.METADATA_KEYS
         }
-        json_string = json.dumps(metadata)
         metadata["DOI"] = self.get_doi_from_metadata(metadata)
-        yield ("metadata.json", json_string.encode("utf-8"))
+        yield ("metadata.json", orjson.dumps(metadata))
 
 
 class PDFCorpusExtractor(MimeBasedCorpusExtractor):
@@ -157,8 +168,7 @@ class DebugCorpusExtractor(BaseCorpusExtractor):
 
     @staticmethod
     def validate_identifier(identifier, metadata):
-        session = requests.session()
-        content_type = session.head(identifier).headers.get("content-type")
+        content_type = _head_content_type(identifier)
         print(f"[{metadata.doab_id}:PUB] - {metadata.metadata['publisher']}")
         print("[IDENTIFIER] -  ", identifier)
         print("[CONTENT_TYPE] - ", content_type)
@@ -177,6 +187,8 @@ class BloomsburyExtractor(HTTPCorpusExtractorMixin, BaseCorpusExtractor):
     TITLE_TEMPL = '(\/book\/{book_title}/.+)'
     CHAPTER_TEMPL = '/book/{book_title}/(.+)'
     TITLE_RE = re.compile(r'\/book\/(.+?).ris')
+    # Only the links are read from the book pages
+    STRAINER = SoupStrainer("a", href=True)
 
     @staticmethod
     def validate_identifier(identifier, doab_record):
@@ -189,19 +201,21 @@ class BloomsburyExtractor(HTTPCorpusExtractorMixin, BaseCorpusExtractor):
         for identifier in identifiers:
             try:
                 base = self._fetch(identifier)
-                soup = BeautifulSoup(base, "html.parser")
+                soup = BeautifulSoup(
+                    base, "lxml", parse_only=self.STRAINER)
                 book_link = soup.find(name='a', attrs={'href':self.TITLE_RE})
                 if not book_link:
                     logger.debug(f"Title slug not found in {identifier}")
                     continue
                 title = self.TITLE_RE.search(book_link['href']).group(1)
                 logger.debug(f"Found title slug {title}")
-                search_re = self.TITLE_TEMPL.format(book_title=title)
-                chapter_title_re = self.CHAPTER_TEMPL.format(book_title=title)
+                search_re = re.compile(self.TITLE_TEMPL.format(book_title=title))
+                chapter_title_re = re.compile(
+                    self.CHAPTER_TEMPL.format(book_title=title))
 
-                for ref in soup.find_all(name='a', href=re.compile(search_re)):
+                for ref in soup.find_all(name='a', href=search_re):
                     if ref and 'href' in ref.attrs and '{page_no}' not in ref['href']:
-                        yield (f'{re.search(chapter_title_re, ref["href"]).group(1)}.html',
+                        yield (f'{chapter_title_re.search(ref["href"]).group(1)}.html',
                                self._fetch(f'{self.HTML_BASE_URL}{ref["href"]}'))
 
             except requests.exceptions.HTTPError as e:
@@ -268,6 +282,7 @@ class SpringerCorpusExtractor(BaseCorpusExtractor):
     PDF_BASE_URL = "https://link.springer.com/content/pdf/"
     EPUB_BASE_URL = "https://link.springer.com/download/epub/"
     IDENTIFIER = 'SpringerCorpusExtractor'
+    exclusive = True
 
     @staticmethod
     def validate_identifier(identifier, doab_record):
@@ -298,11 +313,7 @@ class SpringerCorpusExtractor(BaseCorpusExtractor):
 
     @staticmethod
     def _fetch(uri):
-        response = requests.get(uri)
-        if response.status_code == 200:
-            return(response.content)
-        else:
-            response.raise_for_status()
+        return fetch_cached(get_http_session(), uri)
 
     @property
     def doi(self):
@@ -311,6 +322,11 @@ class SpringerCorpusExtractor(BaseCorpusExtractor):
 
 
 class OpenEditionsExtractor(HTTPCorpusExtractorMixin):
+    exclusive = True
+    # Only the elements read from each page are built into the soups
+    LANDING_PAGE_STRAINER = SoupStrainer("a", href=True)
+    READER_STRAINER = SoupStrainer("link", rel="Next")
+    CITATIONS_STRAINER = SoupStrainer("p")
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -348,7 +364,10 @@ class OpenEditionsExtractor(HTTPCorpusExtractorMixin):
         publisher_url, oe_id = self.identifier.rsplit("/", 1)
 
         landing_page_html = self._fetch(self.identifier)
-        soup = BeautifulSoup(landing_page_html, "html.parser")
+        soup = BeautifulSoup(
+            landing_page_html, "lxml",
+            parse_only=self.LANDING_PAGE_STRAINER,
+        )
         open_access = soup.find(name="span", attrs={"id":"acces-lire"})
         if not open_access:
             raise Exception("Book is not Open Access")
@@ -368,7 +387,10 @@ class OpenEditionsExtractor(HTTPCorpusExtractorMixin):
         citations = set()
         next_page_url = reader_url
         while next_page_url:
-            soup = BeautifulSoup(self._fetch(next_page_url), "html.parser")
+            soup = BeautifulSoup(
+                self._fetch(next_page_url), "lxml",
+                parse_only=self.READER_STRAINER,
+            )
             logger.debug(f"Extracting citations from {next_page_url}")
             next_page_url, citations_in_page = self.extract_citations(
                 soup, next_page_url)
@@ -406,7 +428,10 @@ class OpenEditionsExtractor(HTTPCorpusExtractorMixin):
         """Exctracts the citations from the view used by the book reader"""
         citation_querystring = "?format=bibliographie&lang=en&norecordurl=1"
         citations_url = f"{page_url}{citation_querystring}"
-        soup = BeautifulSoup(self._fetch(citations_url), "html.parser")
+        soup = BeautifulSoup(
+            self._fetch(citations_url), "lxml",
+            parse_only=self.CITATIONS_STRAINER,
+        )
         found = soup.find_all(name="p", attrs={
             "class": lambda class_: class_ in ("bibliographie", "texte")})
         if found:
@@ -449,16 +474,19 @@ class OpenEditionsProber(DebugCorpusExtractor):
         return False
 
 
+# Extractors that validate identifiers without network access go first, so
+# that the MIME based extractors (which issue a HEAD request) are only probed
+# as a last resort
 CORPUS_EXTRACTORS = [
     #DebugCorpusExtractor,
     #OpenEditionsProber,
     OpenEditionsExtractor,
     JSONMetadataExtractor,
-    PDFCorpusExtractor,
-    EPUBCorpusExtractor,
     SpringerCorpusExtractor,
     CambridgeUniversityPressExtractor,
     BloomsburyExtractor,
+    PDFCorpusExtractor,
+    EPUBCorpusExtractor,
     #UPExtractor,
 ]
 
@@ -1,14 +1,18 @@
 from contextlib import ContextDecorator
 import os
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import(
     scoped_session,
     sessionmaker,
 )
 
+from doab import const
+
 _ENGINE = None
 _SESSION = None
+# Rows sent on each multi-row INSERT statement
+EXECUTEMANY_PAGE_SIZE = 10000
 
 def get_dsn():
     return "postgres://%s:%s@%s/%s" % (
@@ -18,13 +22,35 @@ def get_dsn():
         os.getenv("DOAB_DB_NAME", "doab"),
     )
 
-def start_engine(dsn=get_dsn(), echo=False):
+def get_echo():
+    return os.getenv("DOAB_SQL_ECHO", "").lower() in {"1", "true", "yes"}
+
+def start_engine(dsn=get_dsn(), echo=get_echo()):
     global _ENGINE
     global _SESSION
     if not _ENGINE:
-        _ENGINE = create_engine(dsn)
+        # Batches executemany() INSERTs into multi-row VALUES statements,
+        # so flushing many new rows (e.g. references) costs few round-trips
+        _ENGINE = create_engine(
+            dsn, echo=echo,
+            executemany_mode="values",
+            executemany_values_page_size=EXECUTEMANY_PAGE_SIZE,
+        )
+        event.listen(_ENGINE, "connect", _set_similarity_threshold)
         _SESSION = scoped_session(sessionmaker(_ENGINE))
 
+def _set_similarity_threshold(dbapi_connection, connection_record):
+    """ Sets the threshold used by the pg_trgm `%` operator
+
+    Set once per connection, rather than calling set_limit() per query
+    """
+    with dbapi_connection.cursor() as cursor:
+        cursor.execute(
+            "SET pg_trgm.similarity_threshold = %s",
+            (const.MIN_TITLE_SIMILARITY,),
+        )
+    dbapi_connection.commit()
+
 class session_context(ContextDecorator):
     def __init__(self, dsn=None, *args, **kwargs):
         if not _ENGINE:
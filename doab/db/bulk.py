@@ -0,0 +1,91 @@
+"""
+Bulk loading helpers for the postgres backend
+"""
+import csv
+import io
+import logging
+
+from psycopg2.extras import execute_values
+
+from doab.db import EXECUTEMANY_PAGE_SIZE
+
+logger = logging.getLogger(__name__)
+
+PARSED_REFERENCE_COLUMNS = (
+    "reference_id",
+    "raw_reference",
+    "parser",
+    "authors",
+    "title",
+    "pages",
+    "journal",
+    "volume",
+    "doi",
+    "year",
+)
+
+
+def bulk_link_references(
+    connection, book_id, reference_ids, page_size=EXECUTEMANY_PAGE_SIZE,
+):
+    """ Stores references and links them to a book, ignoring existing ones
+
+    :param connection: A psycopg2 connection
+    :param book_id: The DOAB id of the book
+    :param reference_ids: An iterable of reference ids
+    :param page_size: The number of rows sent on each INSERT statement
+    """
+    reference_ids = list(reference_ids)
+    with connection.cursor() as cursor:
+        execute_values(
+            cursor,
+            "INSERT INTO reference (id) VALUES %s ON CONFLICT DO NOTHING",
+            [(reference_id,) for reference_id in reference_ids],
+            page_size=page_size,
+        )
+        execute_values(
+            cursor,
+            "INSERT INTO book_reference (book_id, reference_id) VALUES %s "
+            "ON CONFLICT DO NOTHING",
+            [(book_id, reference_id) for reference_id in reference_ids],
+            page_size=page_size,
+        )
+
+
+def bulk_copy_parsed_references(connection, rows):
+    """ Loads parsed references with COPY, ignoring those already stored
+
+    Rows are streamed as CSV into a temporary staging table and then moved
+    into `parsed_reference` with a single INSERT ... SELECT
+    :param connection: A psycopg2 connection
+    :param rows: An iterable of mappings from column names to values
+    :return: The number of rows inserted
+    """
+    columns = ", ".join(PARSED_REFERENCE_COLUMNS)
+    buf = io.StringIO()
+    # Strings are always quoted, so that unquoted empty fields are NULLs
+    writer = csv.writer(buf, quoting=csv.QUOTE_NONNUMERIC)
+    for row in rows:
+        writer.writerow([row.get(column) for column in PARSED_REFERENCE_COLUMNS])
+    buf.seek(0)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE TEMP TABLE parsed_reference_stage "
+            "(LIKE parsed_reference INCLUDING DEFAULTS)"
+        )
+        cursor.copy_expert(
+            f"COPY parsed_reference_stage ({columns}) FROM STDIN WITH CSV",
+            buf,
+        )
+        cursor.execute(
+            f"INSERT INTO parsed_reference ({columns}) "
+            f"SELECT {columns} FROM parsed_reference_stage "
+            "ON CONFLICT DO NOTHING"
+        )
+        inserted = cursor.rowcount
+        cursor.execute("DROP TABLE parsed_reference_stage")
+
+    logger.debug(f"Copied {inserted} parsed references")
+    return inserted
+
@@ -0,0 +1,35 @@
+"""Adds exact match indexes on parsed references
+
+Revision ID: 5d2e1a7c9b04
+Revises: 95c8e8e3536f
+Create Date: 2026-10-16 14:32:07.518240
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d2e1a7c9b04'
+down_revision = '95c8e8e3536f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # CONCURRENTLY can't run inside a transaction
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'parse_ref_doi_idx', 'parsed_reference', ['doi'],
+            unique=False, postgresql_concurrently=True,
+        )
+        op.create_index(
+            'parse_ref_lower_title_idx', 'parsed_reference',
+            [sa.text('lower(title)')],
+            unique=False, postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    op.drop_index('parse_ref_lower_title_idx', table_name='parsed_reference')
+    op.drop_index('parse_ref_doi_idx', table_name='parsed_reference')
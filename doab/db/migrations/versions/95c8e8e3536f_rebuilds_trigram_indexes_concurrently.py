@@ -0,0 +1,44 @@
+"""Rebuilds trigram indexes concurrently
+
+Revision ID: 95c8e8e3536f
+Revises: 3f51db0d3b56
+Create Date: 2026-10-16 10:12:41.204118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '95c8e8e3536f'
+down_revision = '3f51db0d3b56'
+branch_labels = None
+depends_on = None
+
+# (index name, table, column) of the trigram indexes to rebuild
+TRGM_INDEXES = (
+    ('title_idx', 'book', 'title'),
+    ('parse_ref_title_idx', 'parsed_reference', 'title'),
+)
+
+
+def upgrade():
+    # CONCURRENTLY can't run inside a transaction. The replacement index is
+    # built before the old one is dropped so that lookups never lose it
+    with op.get_context().autocommit_block():
+        for name, table, column in TRGM_INDEXES:
+            # A failed CREATE INDEX CONCURRENTLY leaves an INVALID index
+            # behind, which must not be renamed into place on a rerun
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}_new')
+            op.execute(
+                f'CREATE INDEX CONCURRENTLY {name}_new '
+                f'ON {table} USING gin ({column} gin_trgm_ops)'
+            )
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+            op.execute(f'ALTER INDEX {name}_new RENAME TO {name}')
+
+
+def downgrade():
+    # Intentionally a no-op: the rebuilt indexes have the same definition
+    # as the ones they replace
+    pass
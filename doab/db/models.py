@@ -12,6 +12,8 @@ from sqlalchemy import (
     Table,
     Text,
     UniqueConstraint,
+    func,
+    text,
 )
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
@@ -20,6 +22,18 @@ from doab import const
 from doab.files import EPUBFileManager
 from doab.parsing import yield_miners, get_parser_by_name
 
+__all__ = [
+    "Author",
+    "Base",
+    "Book",
+    "Identifier",
+    "Intersection",
+    "ParsedReference",
+    "Reference",
+    "book_author",
+    "book_reference",
+]
+
 Base = declarative_base()
 
 #Linking table: Authors of a book
@@ -70,18 +84,21 @@ class Book(Base):
         return yield_miners(self, input_path)
 
     def citation(self, input_path=const.DEFAULT_OUT_DIR):
-        output = ''
+        authors = []
         for author in self.authors:
-            output += '{0}{1}{2} {3}, '.format(author.first_name,
-                                               ' ' if author.middle_name and author.middle_name != '' else '',
-                                               author.middle_name, author.last_name)
-        output += self.title
-        output += ' ({0}). Handled by: {1}. ID: {2}'.format(self.publisher, self.parsers(input_path), self.doab_id)
+            middle_name = f" {author.middle_name}" if author.middle_name else ""
+            authors.append(
+                f"{author.first_name}{middle_name} {author.last_name}, ")
+        handled_by = ", ".join(
+            miner.__name__ for miner in self.parsers(input_path))
 
-        return output
+        return (
+            f"{''.join(authors)}{self.title} ({self.publisher}). "
+            f"Handled by: {handled_by}. ID: {self.doab_id}"
+        )
 
     def update_with_metadata(self, metadata):
-        self.title = metadata["title"],
+        self.title = metadata["title"]
         self.description = metadata["description"]
         self.publisher = metadata["publisher"]
 
@@ -132,6 +149,9 @@ class ParsedReference(Base):
         Index('parse_ref_title_idx', "title",
               postgresql_ops={"title": "gin_trgm_ops"},
               postgresql_using='gin'),
+        # Exact lookups, the trigram index can't seek an equal value
+        Index('parse_ref_doi_idx', "doi"),
+        Index('parse_ref_lower_title_idx', func.lower(text("title"))),
     )
     reference_id = Column(String, ForeignKey("reference.id"), primary_key=True)
     raw_reference = Column(Text)
@@ -1,10 +1,15 @@
 import logging
+import mmap
 from operator import itemgetter
 import os
+import posixpath
+import threading
+from urllib.parse import unquote
+from weakref import WeakValueDictionary
 import zipfile
 
 from doab import const
-from ebooklib import epub
+from lxml import etree
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +20,8 @@ class FileManager():
         if not base_path.startswith("/"):
             base_path = os.path.join(os.getcwd(), base_path)
         self.base_path = base_path
+        # Directories already created by this manager
+        self._known_dirs = set()
         logger.debug("File manager using %s" % self.base_path)
 
     def write_bytes(self, *path_parts, filename, to_write):
@@ -26,8 +33,9 @@ class FileManager():
             f.write(to_write)
 
     def makedirs(self, path):
-        if not os.path.exists(path):
-            os.makedirs(path)
+        if path not in self._known_dirs:
+            os.makedirs(path, exist_ok=True)
+            self._known_dirs.add(path)
 
     def list(self, *path_parts, hidden=False):
         path = os.path.join(self.base_path, *path_parts)
@@ -40,6 +48,23 @@ class FileManager():
         with open(read_path, f"r{mode}") as read_file:
             return read_file.read()
 
+    def contains(self, *path_parts, needle):
+        """Checks if a file contains the given bytes without reading it all
+        :param *path_parts: any number of parts to be joined for the path
+        :param needle: The `bytes` to look for
+        :return: `bool`
+        """
+        read_path = os.path.join(self.base_path, *path_parts)
+        with open(read_path, "rb") as read_file:
+            try:
+                with mmap.mmap(
+                    read_file.fileno(), 0, access=mmap.ACCESS_READ
+                ) as mapped:
+                    return mapped.find(needle) != -1
+            except ValueError:
+                # Empty files can't be mapped
+                return False
+
     def readlines(self, *path_parts, mode=""):
         read_path = os.path.join(self.base_path, *path_parts)
         with open(read_path, f"r{mode}") as read_file:
@@ -51,53 +76,110 @@ class FileManager():
         :param *path_parts: aany number of parts to be joined for the path
         :param out: The output path for extracting the contents. If set to None
             it will extract in memory
+        :return: If extracting in memory, an iterator of tuples of the format
+            (filename, contents)
         """
-        read_path = os.path.join(self.base_path, *path_parts)
-        zip_file = self._get_zipfile(read_path)
         if out:
-            zip_file.extractall(out)
+            read_path = os.path.join(self.base_path, *path_parts)
+            with self._get_zipfile(read_path) as zip_file:
+                zip_file.extractall(out)
         else:
-            for name in zipfile.namelist():
-                content = zipfile.read(name)
-                yield content
+            return (
+                (filename, entry.read())
+                for filename, entry in self.iter_entries(*path_parts)
+            )
+
+    def iter_entries(self, *path_parts):
+        """Iterates over the entries of a zip file without reading them
+
+        The file objects are only valid until the next entry is requested
+        :param *path_parts: aany number of parts to be joined for the path
+        :return: An iterator of tuples of the format (filename, file object)
+        """
+        read_path = os.path.join(self.base_path, *path_parts)
+        with self._get_zipfile(read_path) as zip_file:
+            for info in zip_file.infolist():
+                with zip_file.open(info) as entry:
+                    yield info.filename, entry
 
     def _get_zipfile(self, path, mode="r"):
         return zipfile.ZipFile(path, mode)
 
     @property
     def types(self):
-        return_types = []
+        """ The recognized book types found under base_path
 
-        for filetype, filename in const.RECOGNIZED_BOOK_TYPES.items():
-            if os.path.exists(os.path.join(self.base_path, filename)):
-                return_types.append(filetype)
+        The directory is listed once instead of checking for each file
+        :return: A list of keys of `const.RECOGNIZED_BOOK_TYPES`
+        """
+        try:
+            filenames = set(os.listdir(self.base_path))
+        except (FileNotFoundError, NotADirectoryError):
+            return []
 
-        return return_types
+        return [
+            filetype
+            for filetype, filename in const.RECOGNIZED_BOOK_TYPES.items()
+            if filename in filenames
+        ]
 
 
 class EPUBFileManager(FileManager):
+    # Instances shared by path, see `EPUBFileManager.get`
+    _INSTANCES = WeakValueDictionary()
+    _INSTANCES_LOCK = threading.Lock()
+    CONTAINER_PATH = "META-INF/container.xml"
+    NAMESPACES = {
+        "container": "urn:oasis:names:tc:opendocument:xmlns:container",
+        "opf": "http://www.idpf.org/2007/opf",
+    }
+
     def __init__(self, base_path):
+        """
+        :param base_path: The path to the epub file
+        """
         super().__init__(base_path)
         self.epub_filename = base_path
-        self.epub_file = epub.read_epub(self.epub_filename)
-
-    def read(self, filename=None, mime=None):
+        self._zip_file = None
+        self._manifest = None
+        self._navigation = None
+
+    @classmethod
+    def get(cls, base_path):
+        """ Returns a manager for the given epub, shared with other callers
+
+        Managers are kept for as long as someone holds a reference to them,
+        so that an epub is only loaded once by all the finders of a book
+        :param base_path: The path to the epub file
+        :return: An `EPUBFileManager`
+        """
+        key = os.path.abspath(base_path)
+        with cls._INSTANCES_LOCK:
+            manager = cls._INSTANCES.get(key)
+            if manager is None:
+                manager = cls(base_path)
+                cls._INSTANCES[key] = manager
+        return manager
+
+    def read(self, filename=None, mime=None, exclude=()):
         """Returns the contents of the epub file
         :param filename: A string identifying a filename from the epub
         :param mime: A MIME by which to filter the items to be read
-        :return: The contents of a file or an iterable of tuples
-            of the format (filename, contents)
+        :param exclude: Filenames of items that are not to be read
+        :return: An iterable of tuples of the format (filename, contents)
         """
-        for item in self.epub_file.items:
-            name = item.get_name()
+        for name, path, media_type in self.manifest:
+            if name in exclude:
+                continue
             if filename:
                 if filename == name:
-                    return name, item.get_content()
+                    yield name, self._read_item(path)
+                    return
             elif mime:
-                if mime == item.media_type:
-                    yield name, item.get_content()
+                if mime == media_type:
+                    yield name, self._read_item(path)
             else:
-                yield name, item.get_content()
+                yield name, self._read_item(path)
 
     def list(self):
         """ Lists all the items available in the epub document and their MIMEs
@@ -105,11 +187,60 @@ class EPUBFileManager(FileManager):
         :return: A list of tuples of the format (MIME, filename)
         """
         return [
-            (item.media_type, item.get_name())
-            for item in self.epub_file.items
+            (media_type, name)
+            for name, _, media_type in self.manifest
         ]
 
-    def write_bytes(self, *args, **kwargs):
-        raise NotImplementedError
+    @property
+    def manifest(self):
+        """ The items declared in the OPF manifest of the epub
 
+        Only the container and the OPF documents are parsed, items are read
+        from the archive on demand.
+        :return: A list of tuples of the format (filename, path, MIME)
+        """
+        if self._manifest is None:
+            self._manifest = self._read_manifest()
+        return self._manifest
 
+    @property
+    def navigation(self):
+        """ The filenames of the navigation documents (EPUB 3 nav) of the epub
+
+        They are XHTML documents, but never part of the book's content
+        :return: A `frozenset` of filenames
+        """
+        if self._navigation is None:
+            # Found while reading the manifest
+            self.manifest
+        return self._navigation
+
+    def _read_manifest(self):
+        zip_file = self._open_zip()
+        container = etree.fromstring(zip_file.read(self.CONTAINER_PATH))
+        opf_path = container.find(
+            ".//container:rootfile", self.NAMESPACES).get("full-path")
+        opf_dir = posixpath.dirname(opf_path)
+        opf = etree.fromstring(zip_file.read(opf_path))
+
+        manifest = []
+        navigation = set()
+        for item in opf.iterfind("opf:manifest/opf:item", self.NAMESPACES):
+            name = unquote(item.get("href"))
+            path = posixpath.normpath(posixpath.join(opf_dir, name))
+            manifest.append((name, path, item.get("media-type")))
+            if "nav" in (item.get("properties") or "").split():
+                navigation.add(name)
+        self._navigation = frozenset(navigation)
+        return manifest
+
+    def _read_item(self, path):
+        return self._open_zip().read(path)
+
+    def _open_zip(self):
+        if self._zip_file is None:
+            self._zip_file = self._get_zipfile(self.epub_filename)
+        return self._zip_file
+
+    def write_bytes(self, *args, **kwargs):
+        raise NotImplementedError
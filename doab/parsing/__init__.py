@@ -1,16 +1,91 @@
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import os
+
+from doab.files import FileManager
 from .reference_miners import PARSERS, MINERS, FINDERS
 
+logger = logging.getLogger(__name__)
+
+_PARSERS_BY_NAME = {
+    parser.NAME: parser
+    for parser in PARSERS
+    if hasattr(parser, "NAME")
+}
+
+
+# Miners that handle books of any publisher
+_ALL_PUBLISHERS_MINERS = [
+    miner for miner in MINERS if "all" in miner.PUBLISHER_NAMES
+]
+# Miners by the publisher they handle, followed by those handling any
+# publisher, in the order of MINERS
+_MINERS_BY_PUBLISHER = {
+    publisher: [
+        miner for miner in MINERS
+        if publisher in miner.PUBLISHER_NAMES
+        or miner in _ALL_PUBLISHERS_MINERS
+    ]
+    for miner in MINERS
+    if miner not in _ALL_PUBLISHERS_MINERS
+    for publisher in miner.PUBLISHER_NAMES
+}
+
+
 def yield_miners(book, input_path):
-    for parser in MINERS:
-        if parser.can_handle(book, input_path):
+    # Every miner checks the same directory, so it is only listed once
+    filetypes = FileManager(os.path.join(input_path, book.doab_id)).types
+    candidates = _MINERS_BY_PUBLISHER.get(
+        book.publisher, _ALL_PUBLISHERS_MINERS)
+    for parser in candidates:
+        if parser.can_handle(book, input_path, filetypes):
             yield parser
 
 
 def get_parser_by_name(parser):
-    for parse_class in PARSERS:
-        if parse_class.NAME == parser:
-            return parse_class
-    return None
+    """ Returns the parser class registered under the given name
+    :raises KeyError: If there is no parser with the given name
+    """
+    return _PARSERS_BY_NAME[parser]
+
+
+def run_miners_parallel(books, input_path, workers=None):
+    """ Finds the references of the given books across a pool of processes
+
+    Only the references are found in the pool, parsing and persisting them is
+    left to the caller so that DB sessions are never shared across processes
+    :param books: An iterable of `models.Book`
+    :param input_path: The path where books have been extracted
+    :param workers: The number of processes, defaults to the number of CPUs
+    :return: An iterator of tuples (miner class, book_id, references)
+    """
+    jobs = [
+        (miner, str(book.doab_id), os.path.join(input_path, str(book.doab_id)))
+        for book in books
+        for miner in yield_miners(book, input_path)
+    ]
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        yield from executor.map(_prepare_one, jobs)
+
+
+def _prepare_one(job):
+    miner, book_id, book_path = job
+    try:
+        miner_for_book = miner(book_id, book_path)
+        miner_for_book.prepare()
+    except FileNotFoundError:
+        # Let the caller find (and report) the missing files again
+        return miner, book_id, {}
+    except Exception:
+        # A bad book must not abort the others. The caller finds its
+        # references again, reporting the error for that book alone
+        logger.exception(f"{miner.__name__} failed to prepare book {book_id}")
+        return miner, book_id, {}
+    return miner, book_id, miner_for_book.references
 
 
-__all__ = PARSERS + FINDERS + MINERS + [yield_miners, get_parser_by_name]
+__all__ = PARSERS + FINDERS + MINERS + [
+    yield_miners,
+    get_parser_by_name,
+    run_miners_parallel,
+]
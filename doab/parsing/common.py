@@ -1,10 +1,75 @@
+from functools import lru_cache
+import hashlib
 from itertools import chain
 import logging
+import re
 import shutil
 import subprocess
+from typing import NamedTuple, Optional, Union
 
 logger = logging.getLogger(__name__)
 
+# PATH lookups are memoized, commands are not expected to move during a run
+_which = lru_cache(maxsize=None)(shutil.which)
+
+# Punctuation and whitespace, in any script
+NON_ALPHANUMERIC_RE = re.compile(r"[\W_]+")
+
+
+def canonical_key(reference):
+    """ Hashes a reference ignoring case, whitespace and punctuation
+
+    References that only differ in their formatting share the same key
+    :param reference: The reference `str`
+    :return: A 16 byte digest
+    """
+    normalised = NON_ALPHANUMERIC_RE.sub("", reference.casefold())
+    return hashlib.blake2b(
+        normalised.encode("utf-8"), digest_size=16).digest()
+
+
+def unique_references(references):
+    """ Drops references sharing a canonical key, keeping the first one seen
+
+    :param references: An iterable of reference `str`
+    :return: A `list` of references in the order they were first seen
+    """
+    unique = {}
+    for reference in references:
+        unique.setdefault(canonical_key(reference), reference)
+    return list(unique.values())
+
+
+class ParseResult(NamedTuple):
+    """ The fields a parser managed to extract from a reference
+
+    Missing fields are `None`, so that they are stored as NULLs
+    """
+    title: Optional[str] = None
+    author: Optional[str] = None
+    journal: Optional[str] = None
+    volume: Optional[str] = None
+    year: Optional[Union[str, int]] = None
+    pages: Optional[str] = None
+    doi: Optional[str] = None
+    raw_reference: Optional[str] = None
+    parser: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, fields):
+        """ Builds a result from a `dict`, ignoring any unknown keys
+
+        :param fields: A mapping of field names to values (e.g. a bibtex entry)
+        :return: A `ParseResult`
+        """
+        return cls(**{
+            name: value for name, value in fields.items()
+            if name in cls._fields
+        })
+
+    def to_dict(self):
+        return dict(self._asdict())
+
 
 class SubprocessMixin(object):
     """ Mixin for calling an external command in a subprocess"""
@@ -13,25 +78,53 @@ class SubprocessMixin(object):
 
     @classmethod
     def check_cmd(cls):
-        if not shutil.which(cls.CMD):
+        """ Resolves the absolute path to CMD
+        :return: The path to the command `str`
+        """
+        cmd_path = _which(cls.CMD)
+        if not cmd_path:
             raise EnvironmentError(f"command `{cls.CMD}` not in path")
+        return cmd_path
 
     @classmethod
-    def call_cmd(cls, *args):
-        cls.check_cmd()
-        logger.debug(f"Spawning process to run {cls.CMD} with args: {args}")
-        stdout = subprocess.check_output([cls.CMD, *chain(cls.ARGS, args)])
-        return stdout.decode("utf-8")
+    def call_cmd(cls, *args, encoding="utf-8", base_args=None):
+        """ Runs CMD with the given arguments appended to its base arguments
 
+        :param encoding: The encoding used to decode the output
+        :param base_args: Overrides the ARGS of the class
+        :return: The `str` output of the command
+        """
+        if base_args is None:
+            base_args = cls.ARGS
+        cmd_path = cls.check_cmd()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Spawning process to run {cls.CMD} with args: {args}")
+        process = subprocess.run(
+            [cmd_path, *chain(base_args, args)],
+            stdout=subprocess.PIPE,
+            check=True,
+        )
+        return process.stdout.decode(encoding)
 
-class CleanReferenceMixin(object):
-    """Mixin that provides a clean() staticmethod for cleaning ar reference"""
 
-    @staticmethod
-    def clean(reference):
-        logger.debug(f"Cleaning {reference}")
-        without_newlines = reference.replace("\u200b", "").replace("\n", " ")
-        without_redundant_space = " ".join(without_newlines.split())
-        logger.debug(f"Cleaned to: {without_redundant_space}")
-        return without_redundant_space
+class CleanReferenceMixin(object):
+    """Mixin that provides a clean() classmethod for cleaning a reference"""
+    # Characters to be removed from a reference
+    TO_CLEAN = ("\u200b",)
 
+    @classmethod
+    def clean(cls, reference):
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug(f"Cleaning {reference}")
+        # Those characters are rare, and looking for them is much cheaper
+        # than str.translate, which has no fast path for non-ASCII text
+        for char in cls.TO_CLEAN:
+            if char in reference:
+                reference = reference.replace(char, "")
+        # Splitting collapses and strips whitespace in a single pass, about
+        # twice as fast as substituting every run of it with a regex
+        cleaned = " ".join(reference.split())
+        if debug:
+            logger.debug(f"Cleaned to: {cleaned}")
+        return cleaned
@@ -1,27 +1,189 @@
+from functools import wraps
+from itertools import chain
+import hashlib
+import html
+import io
 import json
 import logging
 import os
-from os.path import isfile
 import re
 from unidecode import unidecode
 
-from bs4 import BeautifulSoup
+from lxml import etree
+import orjson
+from lxml import html as lxml_html
 
-from doab import const
+from doab import cache, const
 from doab.files import EPUBFileManager, FileManager
-from doab.parsing.common import CleanReferenceMixin, SubprocessMixin
+from doab.parsing.common import (
+    CleanReferenceMixin,
+    SubprocessMixin,
+    unique_references,
+)
 
 logger = logging.getLogger(__name__)
 
+# Transliterations for the Latin-1 supplement and Latin extended A and B
+# blocks, which cover most of the non ASCII characters found in references
+ASCII_FOLD = str.maketrans({
+    chr(codepoint): unidecode(chr(codepoint))
+    for codepoint in range(0x80, 0x250)
+})
+
+# Tags that BeautifulSoup (with html.parser) writes as "<tag/>"
+SOUP_VOID_TAGS = frozenset({
+    "area", "base", "basefont", "bgsound", "br", "col", "command", "embed",
+    "frame", "hr", "image", "img", "input", "isindex", "keygen", "link",
+    "menuitem", "meta", "nextid", "param", "source", "spacer", "track", "wbr",
+})
+# Attributes whose values BeautifulSoup splits on whitespace, by tag
+SOUP_LIST_ATTRIBUTES = {
+    "*": {"class", "accesskey", "dropzone"},
+    "a": {"rel", "rev"},
+    "link": {"rel", "rev"},
+    "td": {"headers"},
+    "th": {"headers"},
+    "form": {"accept-charset"},
+    "object": {"archive"},
+    "area": {"rel"},
+    "icon": {"sizes"},
+    "iframe": {"sandbox"},
+    "output": {"for"},
+}
+SOUP_ESCAPE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;"})
+
+
+def soup_markup(element):
+    """ Serialises an lxml element the way BeautifulSoup's `str(tag)` does
+
+    References found in markup are stored by their text, which used to be
+    written by BeautifulSoup 4.7 (attributes in source order), so it is
+    reproduced to keep their ids
+    :param element: An `lxml.etree._Element`
+    :return: The markup `str` of the element, without its tail
+    """
+    parts = []
+    _write_soup_markup(element, parts)
+    return "".join(parts)
+
+
+def _write_soup_markup(element, parts):
+    tag = element.tag
+    if tag is etree.Comment:
+        parts.append(f"<!--{element.text or ''}-->")
+        return
+    if not isinstance(tag, str):
+        # Processing instructions and entities have no place in references
+        return
+
+    parts.append(f"<{tag}")
+    list_attributes = SOUP_LIST_ATTRIBUTES["*"] | SOUP_LIST_ATTRIBUTES.get(
+        tag, set())
+    for name, value in element.attrib.items():
+        if name in list_attributes:
+            value = " ".join(value.split())
+        value = value.translate(SOUP_ESCAPE)
+        if '"' not in value:
+            parts.append(f' {name}="{value}"')
+        elif "'" not in value:
+            parts.append(f" {name}='{value}'")
+        else:
+            value = value.replace('"', "&quot;")
+            parts.append(f' {name}="{value}"')
+    if tag in SOUP_VOID_TAGS:
+        parts.append("/>")
+        return
+
+    parts.append(">")
+    if element.text:
+        parts.append(element.text.translate(SOUP_ESCAPE))
+    for child in element:
+        _write_soup_markup(child, parts)
+        if child.tail:
+            parts.append(child.tail.translate(SOUP_ESCAPE))
+    parts.append(f"</{tag}>")
+
+
+def iter_elements_with_class(source, tag, class_name, encoding=None):
+    """ Streams the `tag` elements with the given class from an HTML source
+
+    Elements are cleared as soon as the caller is done with them (unless they
+    are within a match still being parsed) so that memory usage doesn't grow
+    with the size of the document
+    :param source: A path or a binary file object
+    :param tag: The name of the tag to be selected
+    :param class_name: A single class that the element must have
+    :param encoding: Overrides the encoding declared by the document
+    :return: An iterator of `lxml.etree._Element`
+    """
+    open_matches = 0
+    events = etree.iterparse(
+        source, events=("start", "end"), tag=tag,
+        html=True, encoding=encoding,
+    )
+    try:
+        for event, elem in events:
+            matches = class_name in (elem.get("class") or "").split()
+            if event == "start":
+                open_matches += matches
+                continue
+
+            if matches:
+                open_matches -= 1
+                yield elem
+            if not open_matches:
+                elem.clear()
+                parent = elem.getparent()
+                while parent is not None and elem.getprevious() is not None:
+                    del parent[0]
+    except etree.XMLSyntaxError as e:
+        logger.debug(f"Stopped parsing HTML document: {e}")
+
+
+def cached_find(find):
+    """ Caches the references found on disk, keyed by the finder's sources
+
+    Cached results are invalidated when the size or modification time of any
+    of the source files changes
+    """
+    @wraps(find)
+    def wrapper(self):
+        try:
+            key = self.cache_key()
+        except FileNotFoundError:
+            return find(self)
+
+        cached = cache.load(key)
+        if cached is not None:
+            logger.debug(f"Using cached references for {self.book_id}")
+            return cached
+
+        references = find(self)
+        cache.store(key, references)
+        return references
+
+    return wrapper
+
+
+def parse_html(content):
+    """ Parses an HTML document with lxml
+
+    :return: The root element or `None` if the document is empty
+    """
+    try:
+        return lxml_html.fromstring(content)
+    except etree.ParserError:
+        logger.debug("Skipping empty HTML document")
+        return None
+
 
 class BaseReferenceFinder(CleanReferenceMixin):
-    TO_CLEAN = str.maketrans({
-        char: None
-        for char in {
-            "«", "»", "\u200b",
+    TO_CLEAN = ("«", "»", "\u200b")
+    # Bump to invalidate cached references when the finding logic changes
+    CACHE_VERSION = 8
+    # Documents without these bytes contain no references and aren't parsed
+    MARKER = None
 
-        }
-    })
     def __init__(self, book_id, book_path, *args, **kwargs):
         self.book_id = book_id
         self.book_path = book_path
@@ -29,18 +191,39 @@ class BaseReferenceFinder(CleanReferenceMixin):
     def find(self):
         """ Routines to be run in preparation to parsing the references
 
-        Should populate the self.references map
+        :return: A `list` of unique references in document order
         """
         raise NotImplementedError
 
+    @property
+    def source_paths(self):
+        """ The paths to the files from which references are found """
+        return [self.file_manager.base_path]
+
+    def cache_key(self):
+        """ Builds a key identifying the current state of the source files
+        :return: A hex digest `str`
+        """
+        key = f"{self.__class__.__name__}|{self.CACHE_VERSION}"
+        for path in sorted(self.source_paths):
+            stat = os.stat(path)
+            key += f"|{path}|{stat.st_mtime_ns}|{stat.st_size}"
+        return hashlib.blake2b(key.encode("utf-8")).hexdigest()
+
     @classmethod
     def clean(cls, reference):
-        logger.debug(f"Cleaning {reference}")
-        without_newlines = reference.replace("\n", " ")
-        without_redundant_space = " ".join(without_newlines.split())
-        purged = without_redundant_space.translate(cls.TO_CLEAN)
-        transliterated = unidecode(purged)
-        logger.debug(f"Cleaned to: {transliterated}")
+        # References are stored by their cleaned text, so characters are
+        # removed after collapsing whitespace, as they always have been, to
+        # keep the ids of the references already stored
+        cleaned = " ".join(reference.split())
+        for char in cls.TO_CLEAN:
+            if char in cleaned:
+                cleaned = cleaned.replace(char, "")
+        transliterated = cleaned.translate(ASCII_FOLD)
+        if not transliterated.isascii():
+            transliterated = unidecode(transliterated)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Transliterated to: {transliterated}")
         return transliterated
 
 
@@ -50,37 +233,43 @@ class PDFDOIFinder(BaseReferenceFinder, SubprocessMixin):
         super().__init__(book_id, book_path, *args, **kwargs)
         self.file_manager = FileManager(os.path.join(book_path, const.RECOGNIZED_BOOK_TYPES['pdf']))
 
+    @cached_find
     def find(self):
-        references = set()
         pdf_path = os.path.join(self.book_path, const.RECOGNIZED_BOOK_TYPES["pdf"])
-        text = self.call_cmd(pdf_path, "-")
-        return {doi for doi in const.DOI_RE.findall(text)}
+        # DOIs are ASCII, so there is no need for a full utf-8 decode
+        text = self.call_cmd(pdf_path, "-", encoding="latin-1")
+        return list(dict.fromkeys(const.DOI_RE.findall(text)))
 
 class EPUBReferenceFinder(BaseReferenceFinder):
+    # (tag, class) of the elements containing references
     HTML_FILTER = (None, None)
 
     def __init__(self, book_id, book_path, *args, **kwargs):
         super().__init__(book_id, book_path, *args, **kwargs)
-        self.file_manager = EPUBFileManager(os.path.join(book_path, const.RECOGNIZED_BOOK_TYPES['epub']))
+        self.file_manager = EPUBFileManager.get(os.path.join(book_path, const.RECOGNIZED_BOOK_TYPES['epub']))
 
+    @cached_find
     def find(self):
-        references = set()
-        for _, content in self.file_manager.read(mime="application/xhtml+xml"):
-            soup = BeautifulSoup(content, "html.parser")
-            references |= self.process_soup(soup)
-
-        return references
-
-    def process_soup(self, soup):
-        tag, attributes = self.HTML_FILTER
-        return {
+        navigation = self.file_manager.navigation
+        return unique_references(chain.from_iterable(
+            self.process_html(io.BytesIO(content))
+            for _, content in self.file_manager.read(
+                mime="application/xhtml+xml", exclude=navigation)
+            if not self.MARKER or self.MARKER in content
+        ))
+
+    def process_html(self, source):
+        tag, class_name = self.HTML_FILTER
+        # XHTML content documents must be encoded in UTF-8
+        return (
             self.clean_html(html_ref)
-            for html_ref in soup.find_all(name=tag, attrs=attributes)
-        }
+            for html_ref in iter_elements_with_class(
+                source, tag, class_name, encoding="utf-8")
+        )
 
     @classmethod
     def clean_html(cls, html_ref):
-        text_ref = html_ref.text
+        text_ref = "".join(html_ref.itertext())
         return cls.clean(text_ref)
 
 
@@ -91,12 +280,15 @@ class CitationTXTReferenceFinder(BaseReferenceFinder):
         self.file_manager = FileManager(os.path.join(
             book_path, const.RECOGNIZED_BOOK_TYPES['txt']))
 
+    @cached_find
     def find(self):
-       return {self.clean(ref) for ref in self.file_manager.readlines()}
+       return unique_references(
+           self.clean(ref) for ref in self.file_manager.readlines())
 
 
 class SpringerEPUBReferenceFinder(EPUBReferenceFinder):
-    HTML_FILTER = ("div", {"class": "CitationContent"})
+    HTML_FILTER = ("div", "CitationContent")
+    MARKER = b"CitationContent"
 
     @classmethod
     def clean_html(cls, html_ref):
@@ -104,14 +296,17 @@ class SpringerEPUBReferenceFinder(EPUBReferenceFinder):
 
         DOIs are `a` tags with the text 'CrossRef', the DOI is in the `href`
         """
-        doi_tag = html_ref.find(name="a", text=lambda x: "CrossRef" in x)
-        if doi_tag and doi_tag["href"]:
-            doi_tag.string =f' {doi_tag["href"]}'
+        for doi_tag in html_ref.iter("a"):
+            if doi_tag.text and "CrossRef" in doi_tag.text:
+                if doi_tag.get("href"):
+                    doi_tag.text = f' {doi_tag.get("href")}'
+                break
         return super().clean_html(html_ref)
 
 
 class BloomsburyReferenceFinder(BaseReferenceFinder):
-    HTML_FILTER = ("div", {"class": "bibliomixed"})
+    HTML_FILTER = ("div", "bibliomixed")
+    MARKER = b"bibliomixed"
     # <div class="contribution bibliomixed"><a name="ba-9781849661027-bib31"></a><p class="contribution bibliomixed"><a class="openurl" target="_blank" data-href="?genre=bookitem&amp;title=Democracy and the Rule of Law&amp;atitle=Lineages of the Rule of Law&amp;aulast=Maravall&amp;aufirst=J.&amp;volume=&amp;issue=&amp;pages=&amp;date=2003">
     #       					Find in Library
     #       				</a><span class="bibliomset"><span class="author"><span class="surname">Holmes</span>, <span class="firstname">S.</span></span>
@@ -122,62 +317,95 @@ class BloomsburyReferenceFinder(BaseReferenceFinder):
 
     def __init__(self, book_id, book_path, *args, **kwargs):
         super().__init__(book_id, book_path, *args, **kwargs)
-        book_files = [f for f in os.listdir(book_path) if isfile(os.path.join(book_path, f))]
-        self.file_managers = [
-            FileManager(os.path.join(book_path, book_file))
-            for book_file in book_files
-            if '.html' in book_file
-        ]
-
+        with os.scandir(book_path) as entries:
+            self.file_managers = [
+                FileManager(entry.path)
+                for entry in entries
+                if entry.name.endswith(".html") and entry.is_file()
+            ]
+
+    @property
+    def source_paths(self):
+        return [file_manager.base_path for file_manager in self.file_managers]
+
+    @cached_find
     def find(self):
-        references = set()
-        for file_manager in self.file_managers:
-            content = file_manager.read()
-
-            soup = BeautifulSoup(content, "html.parser")
-            references |= self.process_soup(soup)
-        return references
-
-    def process_soup(self, soup):
-        tag, attributes = self.HTML_FILTER
-        return {
-            self.clean(str(ref))
-            for ref in soup.find_all(name=tag, attrs=attributes)
-        }
-
+        return unique_references(chain.from_iterable(
+            self.process_html(file_manager.base_path)
+            for file_manager in self.file_managers
+            if not self.MARKER or file_manager.contains(needle=self.MARKER)
+        ))
+
+    def process_html(self, source):
+        tag, class_name = self.HTML_FILTER
+        # The markup is preserved for the BloomsburyAcademicParser
+        return (
+            self.clean(soup_markup(ref))
+            for ref in iter_elements_with_class(
+                source, tag, class_name, encoding="utf-8")
+        )
 
 
 class CambridgeReferenceFinder(BaseReferenceFinder):
-    HTML_FILTER = ("meta", {"name": "citation_reference"})
+    MARKER = b"openResolverFullReferences"
+    # Greedy up to the end of the statement's line, as references can
+    # contain "];" themselves
+    OPENRESOLVER_RE = re.compile(
+        rb'var openResolverFullReferences\s*=\s*(\[.*\]);')
+    META_MARKER = b"citation_reference"
+    # A fast path for the usual layout of the meta tags, see `find`
+    META_RE = re.compile(
+        rb'<meta\s+name="citation_reference"\s+content="([^"]*)"')
+    SELECTOR = etree.XPath('//meta[@name="citation_reference"]/@content')
 
     def __init__(self, book_id, book_path, *args, **kwargs):
         super().__init__(book_id, book_path, *args, **kwargs)
         self.file_manager = FileManager(os.path.join(book_path, const.RECOGNIZED_BOOK_TYPES['CambridgeCore']))
 
+    @cached_find
     def find(self):
-        references = set()
-        content = self.file_manager.read()
+        content = self.file_manager.read(mode="b")
 
         # see if we can get an openresolver set to evaluate
-        openresolver_regex = r'var openResolverFullReferences = (\[.+\]);'
-        or_matches = re.search(openresolver_regex, content, re.MULTILINE)
-
+        or_matches = None
+        if self.MARKER in content:
+            or_matches = self.OPENRESOLVER_RE.search(content)
         if or_matches:
             logger.debug('Using OpenReference variable match')
-            reference_list = json.loads(or_matches.group(1))
-
-            for ref in reference_list:
-                references.add(json.dumps(ref))
-        else:
-            logger.debug('Using soup fallback method')
-            soup = BeautifulSoup(content, "html.parser")
-            references = self.process_soup(soup)
-
-        return references
-
-    def process_soup(self, soup):
-        tag, attributes = self.HTML_FILTER
-        return {
-            self.clean(ref['content'])
-            for ref in soup.find_all(name=tag, attrs=attributes)
-        }
+            try:
+                # A view avoids copying the (often large) variable
+                reference_list = orjson.loads(memoryview(content)[
+                    or_matches.start(1):or_matches.end(1)])
+            except orjson.JSONDecodeError:
+                logger.warning("Unable to decode the OpenReference variable")
+            else:
+                # References are stored by this text, so they are
+                # serialised as they always have been to keep their ids
+                return unique_references(
+                    json.dumps(ref) for ref in reference_list)
+
+        meta_matches = self.META_RE.findall(content)
+        # Tags written any other way (e.g.: content before name) are only
+        # found by parsing the document
+        if meta_matches and len(meta_matches) == content.count(
+            self.META_MARKER
+        ):
+            logger.debug('Using citation_reference meta tags')
+            return unique_references(
+                self.clean(html.unescape(match.decode("utf-8")))
+                for match in meta_matches
+            )
+        if self.META_MARKER not in content:
+            return []
+
+        logger.debug('Using HTML fallback method')
+        root = parse_html(content)
+        if root is None:
+            return []
+        return unique_references(self.process_html(root))
+
+    def process_html(self, root):
+        return (
+            self.clean(content)
+            for content in self.SELECTOR(root)
+        )
@@ -1,13 +1,14 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import logging
+from operator import methodcaller
 import os
 import sys
 
-
-from sqlalchemy.orm.exc import NoResultFound
-
 from doab.files import FileManager
-from doab.db import models
+from doab.db.bulk import bulk_copy_parsed_references, bulk_link_references
 
+from .common import canonical_key, SubprocessMixin
 from .reference_finders import (
     BloomsburyReferenceFinder,
     CambridgeReferenceFinder,
@@ -22,19 +23,28 @@ from .reference_parsers import (
     CrossrefParser,
     BloomsburyAcademicParser,
     CambridgeCoreParser,
+    HTTPBasedParserMixin,
 )
 
 logger = logging.getLogger(__name__)
 
+# The first seen "raw" string of a reference and its "parses" by parser name
+ReferenceEntry = namedtuple("ReferenceEntry", "raw parses")
+
 
 class ReferenceMiner(object):
     REFERENCE_PARSERS = []
     # magic value of 'all' will always return true
     PUBLISHER_NAMES = []
+    # Maximum parsers waiting on an HTTP service (e.g. Crossref) or on a
+    # subprocess (e.g. Cermine) running concurrently
+    BLOCKING_WORKERS = 4
+    BLOCKING_PARSERS = (HTTPBasedParserMixin, SubprocessMixin)
 
     def __init__(self, book_id, book_path):
         self.book_id = book_id
         self.book_path = book_path
+        # Maps the canonical key of a reference to its `ReferenceEntry`
         self.references = {}
         self.parsers = [parser() for parser in self.REFERENCE_PARSERS]
         self.finders = [
@@ -42,95 +52,137 @@ class ReferenceMiner(object):
             for finder in self.REFERENCE_FINDERS
         ]
 
-    def run(self, session=None):
-        self.prepare()
+    def run(self, session=None, commit=True):
+        """ Finds, parses and persists (or prints) the book's references
+
+        :param session: A SQLAlchemy session, when not given the references
+            are printed instead
+        :param commit: See `ReferenceMiner.persist`
+        """
+        if not self.references:
+            self.prepare()
         self.parse()
         if session:
-            self.persist(session)
+            self.persist(session, commit)
         else:
             self.echo()
 
     def prepare(self):
-        for finder in self.finders:
-            for reference in finder.find():
-                if reference not in self.references:
-                    self.references[reference] = {}
+        if len(self.finders) > 1:
+            with ThreadPoolExecutor(max_workers=len(self.finders)) as executor:
+                found = list(executor.map(methodcaller("find"), self.finders))
+        else:
+            found = [finder.find() for finder in self.finders]
+
+        for references in found:
+            for reference in references:
+                key = canonical_key(reference)
+                if key not in self.references:
+                    self.references[key] = ReferenceEntry(reference, {})
 
 
     def parse(self):
-        for reference in self.references.keys():
-            for parser in self.parsers:
-                parsed = parser.parse_reference(reference)
-                self.references[reference][parser.NAME] = parsed
+        """ Parses every reference found with each of the miner's parsers
 
-    def persist(self, session):
+        Parsers backed by an HTTP service or a subprocess don't hold the
+        GIL while they wait, so they run on a pool of threads while the rest
+        of the parsers run on the current thread
+        """
+        entries = list(self.references.values())
+        raw_references = [entry.raw for entry in entries]
+        blocking_parsers = [
+            parser for parser in self.parsers
+            if isinstance(parser, self.BLOCKING_PARSERS)
+        ]
+        local_parsers = [
+            parser for parser in self.parsers
+            if not isinstance(parser, self.BLOCKING_PARSERS)
+        ]
+        with ThreadPoolExecutor(max_workers=self.BLOCKING_WORKERS) as executor:
+            pending = [
+                (parser, executor.submit(
+                    parser.parse_references, raw_references))
+                for parser in blocking_parsers
+            ]
+            parsed = [
+                (parser, parser.parse_references(raw_references))
+                for parser in local_parsers
+            ]
+            parsed.extend(
+                (parser, future.result()) for parser, future in pending)
+
+        for parser, results in parsed:
+            for entry, result in zip(entries, results):
+                entry.parses[parser.NAME] = result
+
+    def persist(self, session, commit=True):
         """ Persists parse results to the database
 
         :param session: A SQLAlchemy session
+        :param commit: If False, the changes are left uncommitted so that
+            the caller can commit several books or miners at once
         """
-        book = session.query(
-            models.Book
-        ).filter(models.Book.doab_id == self.book_id).one()
-        for ref, parses in self.references.items():
-            # Link reference with book
-            try:
-                reference = session.query(
-                    models.Reference
-                ).filter(models.Reference.id == ref).one()
-            except NoResultFound:
-                reference = models.Reference(id=ref)
-                session.add(reference)
-            if reference not in book.references:
-                book.references.append(reference)
-            session.commit()
+        # References are stored and linked with INSERT ... ON CONFLICT, so
+        # the existing ones are never loaded
+        reference_ids = []
+        parsed_rows = []
+        for entry in self.references.values():
+            ref, parses = entry
+            reference_ids.append(ref)
 
             # Store parses of reference if they have a title
             for parser, parsed in parses.items():
-                if parsed and "title" in parsed and parsed["title"]:
-                    try:
-                        parsed_reference = session.query(
-                            models.ParsedReference
-                        ).filter(
-                            models.ParsedReference.reference_id==reference.id,
-                            models.ParsedReference.parser==parser,
-                        ).one()
-
-                        logger.debug("Existing reference found. Ignoring. Use nuke command to update.")
-                    except NoResultFound:
-                        parsed_reference = models.ParsedReference(
-                            reference_id=reference.id,
-                            raw_reference=ref,
-                            parser=parser,
-                            authors=parsed.get("author"),
-                            title=parsed.get("title"),
-                            pages=parsed.get("pages"),
-                            journal=parsed.get("journal"),
-                            volume=parsed.get("volume"),
-                            doi=parsed.get("doi"),
-                            year=parsed.get("year"),
-                        )
-                        session.add(parsed_reference)
-                    session.commit()
-                elif parsed:
-                    logger.debug(f"{parser} returned None")
-                else:
-                    logger.debug(f"{parser} didn't parse a title: {parsed}")
-
+                if parsed and parsed.title:
+                    parsed_rows.append({
+                        "reference_id": ref,
+                        "raw_reference": ref,
+                        "parser": parser,
+                        "authors": parsed.author,
+                        "title": parsed.title,
+                        "pages": parsed.pages,
+                        "journal": parsed.journal,
+                        "volume": parsed.volume,
+                        "doi": parsed.doi,
+                        "year": parsed.year,
+                    })
+                elif logger.isEnabledFor(logging.DEBUG):
+                    if parsed:
+                        logger.debug(f"{parser} didn't parse a title: {parsed}")
+                    else:
+                        logger.debug(f"{parser} returned None")
+
+        try:
+            connection = session.connection().connection
+            # References must exist before their parses are copied
+            bulk_link_references(connection, str(self.book_id), reference_ids)
+            # Existing parses are ignored. Use nuke command to update.
+            if parsed_rows:
+                bulk_copy_parsed_references(connection, parsed_rows)
+            if commit:
+                session.commit()
+        except Exception:
+            session.rollback()
+            raise
 
     def echo(self, stream=None):
         """Prints parse results to the provided stream"""
         if stream is None:
             stream = sys.stdout
-        for reference in self.references:
-            print(reference, file=stream)
+        for entry in self.references.values():
+            print(entry.raw, file=stream)
 
     @classmethod
-    def can_handle(cls, book, input_path):
+    def can_handle(cls, book, input_path, filetypes=None):
+        """ Determines if this miner can handle the given book
+        :param filetypes: The types of files extracted for the book. If not
+            provided, they are looked up under `input_path`
+        """
         if (
             'all' in cls.PUBLISHER_NAMES
             or book.publisher in cls.PUBLISHER_NAMES
         ):
-            filetypes = FileManager(os.path.join(input_path, book.doab_id)).types
+            if filetypes is None:
+                filetypes = FileManager(os.path.join(input_path, book.doab_id)).types
 
             for filetype in cls.FILE_TYPES:
                 if filetype == 'all':
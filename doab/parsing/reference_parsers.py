@@ -1,28 +1,133 @@
-import json
+from bisect import bisect_right
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache, wraps
+from itertools import accumulate, chain
 import logging
+import multiprocessing
+import os
 import re
-
-from bibtexparser.bparser import BibTexParser
-from bs4 import BeautifulSoup
-from crossref.restful import Works
+import selectors
+import subprocess
+import tempfile
+import threading
+import time
+from urllib.parse import quote
+
+from bibtexparser.bibdatabase import BibDatabase
+from bibtexparser.bparser import STANDARD_TYPES, BibTexParser
+from lxml import html as lxml_html
+import orjson
 import requests
 
-from doab import const
-from doab.parsing.common import SubprocessMixin, CleanReferenceMixin
+from doab import cache, const
+from doab.concurrency import get_http_session
+from doab.parsing.common import (
+    CleanReferenceMixin,
+    ParseResult,
+    SubprocessMixin,
+)
 
 logger = logging.getLogger(__name__)
+_threadlocal = threading.local()
+
+
+def get_bibtex_parser():
+    """ A thread-local BibTexParser, emptied of any previous entries
+
+    Building a parser's grammar costs about as much as parsing a reference,
+    so each thread reuses its own
+    """
+    try:
+        bibtex_parser = _threadlocal.bibtex_parser
+    except AttributeError:
+        bibtex_parser = _threadlocal.bibtex_parser = BibTexParser()
+        bibtex_parser.expect_multiple_parse = True
+    bibtex_parser.bib_database = BibDatabase()
+    return bibtex_parser
 
 
 def parse_bibtex(reference, bibtex_parser=None):
     if bibtex_parser is None:
-        bibtex_parser = BibTexParser()
-    try:
-        result = bibtex_parser.parse(reference).get_entry_list()[-1]
-    except IndexError:
-        #unable to parse
-        result = None
+        bibtex_parser = get_bibtex_parser()
+    entries = bibtex_parser.parse(reference).get_entry_list()
+    # None when unable to parse
+    return entries[-1] if entries else None
+
+
+# The single entry printed by Cermine's BibEntry.toBibTeX, one field per line
+CERMINE_BIBTEX_HEAD_RE = re.compile(r"@(\w+)\{([^,\s{}]+),?")
+CERMINE_BIBTEX_FIELD_RE = re.compile(r"\s*(\w+) = \{([^{}\\\t]*)\},?")
 
-    return result
+
+def parse_cermine_bibtex(reference, bibtex_parser=None):
+    """ Reads the bibtex entry printed by Cermine without bibtexparser
+
+    Cermine lays out its entries the same way every time, so their fields are
+    matched line by line. Anything else (e.g.: braces or escapes within a
+    value) is left to `parse_bibtex`, which yields the same entries
+    :param reference: The bibtex `str` printed by Cermine
+    :return: A `dict` with the fields of the entry or None
+    """
+    lines = reference.strip().splitlines()
+    if len(lines) > 1 and lines[-1].strip() == "}":
+        head = CERMINE_BIBTEX_HEAD_RE.fullmatch(lines[0].strip())
+        fields = [CERMINE_BIBTEX_FIELD_RE.fullmatch(l) for l in lines[1:-1]]
+        if head and all(fields):
+            entry_type = head.group(1).lower()
+            if entry_type not in STANDARD_TYPES:
+                return None
+            entry = {}
+            for field in fields:
+                # bibtexparser keeps the first of repeated fields
+                entry.setdefault(field.group(1).lower(), field.group(2))
+            entry["ENTRYTYPE"] = entry_type
+            entry["ID"] = head.group(2)
+            return entry
+    return parse_bibtex(reference, bibtex_parser)
+
+
+# Number of parse results kept by memoize_parse for each parser
+PARSE_CACHE_SIZE = 50000
+
+
+def memoize_parse(parse_reference):
+    """ Caches the result of parsing a reference by parser and reference
+
+    References are often shared across books of the same series or
+    publisher. Results are immutable `ParseResult`, so they are shared as is
+    """
+    @lru_cache(maxsize=PARSE_CACHE_SIZE)
+    def cached(cls, reference):
+        return parse_reference(cls, reference)
+
+    @wraps(parse_reference)
+    def wrapper(cls, reference, *args, **kwargs):
+        if args or kwargs:
+            return parse_reference(cls, reference, *args, **kwargs)
+        return cached(cls, reference)
+
+    return wrapper
+
+
+def parse_many(parser_cls, references, workers=None):
+    """ Parses references with the given parser across a pool of processes
+
+    Only worth it for CPU bound parsers and large numbers of references
+    :param parser_cls: A parser class, it must be importable by the workers
+    :param references: A sequence of reference `str`
+    :param workers: The number of processes, defaults to the number of CPUs
+    :return: A `list` with the result for each reference, in order
+    """
+    # Called from the threads of miners and books, so workers are spawned:
+    # a child forked while another thread holds a lock (logging, requests,
+    # the Cermine batch) would deadlock on it
+    with ProcessPoolExecutor(
+        max_workers=workers or os.cpu_count(),
+        mp_context=multiprocessing.get_context("spawn"),
+    ) as executor:
+        return list(executor.map(
+            parser_cls.parse_reference, references, chunksize=64))
 
 
 class BaseReferenceParser(CleanReferenceMixin):
@@ -35,11 +140,29 @@ class BaseReferenceParser(CleanReferenceMixin):
     # a variable that children can override to specify how good they are
     # compared to other parsers
     accuracy = 0
+    # CPU bound parsers can set the number of references from which they
+    # are parsed across processes
+    PARALLEL_THRESHOLD = None
 
     @classmethod
     def parse_reference(cls, reference):
         return None
 
+    def parse_references(self, references):
+        """ Parses a sequence of references
+
+        Children can override it when parsing in bulk is cheaper
+        :param references: A sequence of reference `str`
+        :return: A `list` with the result for each reference, in order
+        """
+        if (
+            self.PARALLEL_THRESHOLD
+            and len(references) >= self.PARALLEL_THRESHOLD
+            and (os.cpu_count() or 1) > 1
+        ):
+            return parse_many(type(self), references)
+        return [self.parse_reference(reference) for reference in references]
+
 
 class CermineParser(BaseReferenceParser, SubprocessMixin):
     accuracy = 50
@@ -49,13 +172,190 @@ class CermineParser(BaseReferenceParser, SubprocessMixin):
         "pl.edu.icm.cermine.bibref.CRFBibReferenceParser",
         "-format", 'bibtex', "-reference",
     ]
+    # CRFBibReferenceParser only parses a single reference per run, so each
+    # one starts its own JVM. Those are run concurrently instead
+    WORKERS = os.cpu_count() or 1
+    # Parses references streamed over stdin, see scripts/CermineBatch.java
+    BATCH_ARGS = ["/usr/local/bin/CermineBatch.java"]
+    BATCH_SEPARATOR = b"%%\n"
+    # Seconds to wait for the entry of a reference. The first one also waits
+    # for the JVM to start and load Cermine's models
+    BATCH_TIMEOUT = 30
+    BATCH_STARTUP_TIMEOUT = 180
+    # A single CermineBatch process is kept for the lifetime of the
+    # interpreter and shared by all books, see `CermineParser.call_batch`
+    _batch_process = None
+    # Whether the running process has returned an entry yet
+    _batch_started = False
+    # Set once the process fails before returning any entry
+    _batch_disabled = False
+    _batch_lock = threading.Lock()
+
+    def parse_references(self, references):
+        """ Parses all the references with the long-lived CermineBatch JVM
+
+        Falls back to a JVM per reference when the batch program fails or
+        its output can't be matched up with the references given
+        :param references: A sequence of reference `str`
+        :return: A `list` with the result for each reference, in order
+        """
+        if references and not self._batch_disabled:
+            try:
+                return self.parse_batch(references)
+            except (OSError, ValueError) as e:
+                logger.warning(
+                    f"{self.NAME} batch failed ({e}), "
+                    "parsing references one by one"
+                )
+        with ThreadPoolExecutor(max_workers=self.WORKERS) as executor:
+            return list(executor.map(self.parse_reference, references))
+
+    @classmethod
+    def parse_batch(cls, references):
+        """ Parses the references with the long-lived CermineBatch JVM
+
+        References without a title are retried with a trailing full stop,
+        as done by `parse_reference`
+        :param references: A sequence of reference `str`
+        :return: A `list` with the result for each reference, in order
+        """
+        results = [
+            cls.to_result(reference, entry)
+            for reference, entry in zip(
+                references, cls.call_batch(references))
+        ]
+        retries = [
+            i for i, result in enumerate(results)
+            if result is None and not references[i].endswith(".")
+        ]
+        if retries:
+            entries = cls.call_batch([references[i] + "." for i in retries])
+            for i, entry in zip(retries, entries):
+                results[i] = cls.to_result(references[i], entry)
+        return results
+
+    @classmethod
+    def call_batch(cls, references):
+        """ Streams the given references through the CermineBatch process
+
+        The process is started on first use. References are written one at a
+        time, reading back each entry before the next one is sent, so that
+        neither side blocks on a full pipe. Threads take turns on the process
+        for each reference
+        :param references: A sequence of reference `str`
+        :return: A `list` with the bibtex entry (or None) of each reference
+        :raises OSError: If the process exits or times out, it is restarted
+            on next use unless it never returned an entry
+        """
+        if any("\n" in ref or "\r" in ref for ref in references):
+            raise ValueError("references can't contain line breaks")
+
+        entries = []
+        for reference in references:
+            with cls._batch_lock:
+                if cls._batch_disabled:
+                    raise ChildProcessError(f"{cls.CMD} batch is disabled")
+                try:
+                    output = cls.send_batch_reference(reference)
+                except OSError:
+                    cls.stop_batch_process()
+                    raise
+            bibtex_reference = output.decode("utf-8")
+            entries.append(
+                parse_cermine_bibtex(bibtex_reference)
+                if bibtex_reference.strip() else None
+            )
+        return entries
+
+    @classmethod
+    def send_batch_reference(cls, reference):
+        """ Sends a reference to the CermineBatch process and reads its entry
+
+        Must be called holding `_batch_lock`
+        :param reference: The reference `str`
+        :return: The `bytes` output for the reference, without the separator
+        :raises TimeoutError: If the entry isn't read within the timeout
+        :raises ChildProcessError: If the process exits
+        """
+        process = cls._batch_process
+        if process is None or process.poll() is not None:
+            process = cls._batch_process = subprocess.Popen(
+                [cls.check_cmd(), *cls.BATCH_ARGS],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+            )
+            cls._batch_started = False
+        timeout = (
+            cls.BATCH_TIMEOUT if cls._batch_started
+            else cls.BATCH_STARTUP_TIMEOUT
+        )
+        process.stdin.write(reference.encode("utf-8") + b"\n")
+        process.stdin.flush()
+
+        # The pipe is read directly, so that select() sees all the output
+        # not yet read. Nothing is written after the separator until the
+        # next reference is sent
+        separator = cls.BATCH_SEPARATOR
+        fd = process.stdout.fileno()
+        deadline = time.monotonic() + timeout
+        output = b""
+        with selectors.DefaultSelector() as selector:
+            selector.register(fd, selectors.EVENT_READ)
+            while not (
+                output == separator or output.endswith(b"\n" + separator)
+            ):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not selector.select(remaining):
+                    raise TimeoutError(
+                        f"{cls.CMD} batch took over {timeout}s")
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    raise ChildProcessError(f"{cls.CMD} batch exited")
+                output += chunk
+        cls._batch_started = True
+        return output[:-len(separator)]
+
+    @classmethod
+    def stop_batch_process(cls):
+        """ Kills the CermineBatch process after it failed
+
+        If it never returned an entry (e.g.: CermineBatch.java is missing
+        from an outdated doab-base image) the batch is disabled for the rest
+        of the interpreter. Must be called holding `_batch_lock`
+        """
+        process = cls._batch_process
+        cls._batch_process = None
+        if process is not None:
+            process.kill()
+            process.wait()
+        if not cls._batch_started:
+            cls._batch_disabled = True
+            logger.error(
+                f"{cls.NAME} batch failed to start, parsing references one "
+                "by one from now on. Is CermineBatch.java installed?"
+            )
+
+    @classmethod
+    def to_result(cls, reference, entry):
+        """ Builds the parse result of a reference from its bibtex entry
+        :param reference: The reference `str`
+        :param entry: A `dict` parsed from bibtex or None
+        :return: A `ParseResult` or None if the entry has no title
+        """
+        if not entry or not entry.get("title"):
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    f'{cls.NAME} was unable to pull a title from {reference}')
+            return None
+        return ParseResult.from_dict(entry)
 
     @classmethod
+    @memoize_parse
     def parse_reference(cls, reference, bibtex_parser=None):
         bibtex_reference = cls.call_cmd(reference)
-        logger.debug(f"Bibtex {bibtex_reference}")
-        result = parse_bibtex(bibtex_reference, bibtex_parser)
-        fail_message = f'{cls.NAME} was unable to pull a title from {reference}'
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Bibtex {bibtex_reference}")
+        result = parse_cermine_bibtex(bibtex_reference, bibtex_parser)
 
         # append a full stop if there is no title returned and re-run
         if not result or not 'title' in result or not result["title"]:
@@ -63,12 +363,8 @@ class CermineParser(BaseReferenceParser, SubprocessMixin):
             if not reference.endswith("."):
                 retry = reference + '.'
                 return cls.parse_reference(retry)
-            else:
-                logger.debug(fail_message)
-                result = None
-
 
-        return result
+        return cls.to_result(reference, result)
 
 
 class AnystyleParser(BaseReferenceParser, SubprocessMixin):
@@ -76,130 +372,372 @@ class AnystyleParser(BaseReferenceParser, SubprocessMixin):
     NAME = const.ANYSTYLE
     CMD = "anystyle"
     ARGS = ["-f", "bib", "parse_reference"]
+    # Parses a file with one reference per line
+    BATCH_ARGS = ["-f", "bib", "parse"]
 
     @classmethod
+    @memoize_parse
     def parse_reference(cls, reference, bibtex_parser=None):
         if reference.startswith("-"):
             reference = f'"{reference}"'
         bibtex_reference = cls.call_cmd(reference)
-        logger.debug(f"Bibtex {bibtex_reference}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Bibtex {bibtex_reference}")
         result = parse_bibtex(bibtex_reference)
-        fail_message = f'{cls.NAME} was unable to pull a title from {reference}'
 
         if not result or not 'title' in result or not result["title"]:
-            logger.debug(fail_message)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    f'{cls.NAME} was unable to pull a title from {reference}')
             return None
 
-        return result
+        return ParseResult.from_dict(result)
+
+    @classmethod
+    def parse_references(cls, references):
+        """ Parses all the references with a single anystyle process
+
+        Falls back to a process per reference when the entries returned
+        can't be matched up with the references given
+        :param references: A sequence of reference `str`
+        :return: A `list` with the result for each reference, in order
+        """
+        results = [None] * len(references)
+        # Anystyle returns no entry for blank lines, so blank references are
+        # left out of the batch and not parsed at all
+        indexes = [i for i, ref in enumerate(references) if ref.strip()]
+        batch = [references[i] for i in indexes]
+        if len(batch) < 2:
+            for i, ref in zip(indexes, batch):
+                results[i] = cls.parse_reference(ref)
+            return results
+
+        # Cleaned references don't contain line breaks
+        with tempfile.NamedTemporaryFile(
+            "w", suffix=".txt", encoding="utf-8",
+        ) as references_file:
+            references_file.write("\n".join(batch))
+            references_file.flush()
+            bibtex_references = cls.call_cmd(
+                references_file.name, base_args=cls.BATCH_ARGS)
+
+        entries = get_bibtex_parser().parse(
+            bibtex_references).get_entry_list()
+        if len(entries) != len(batch):
+            logger.warning(
+                f"{cls.NAME} returned {len(entries)} entries for "
+                f"{len(batch)} references, parsing them one by one"
+            )
+            entries = None
+
+        for n, (i, ref) in enumerate(zip(indexes, batch)):
+            if entries is None:
+                results[i] = cls.parse_reference(ref)
+            elif entries[n].get("title"):
+                results[i] = ParseResult.from_dict(entries[n])
+        return results
 
 
 class HTTPBasedParserMixin(BaseReferenceParser):
     """ Mixin for requesting references to be parsed by an HTTP service"""
     REQ_METHOD = ""
     SVC_URL = ""
+    HEADERS = {}
+    # Seconds to wait for the service to connect or send data
+    TIMEOUT = 30
 
     def call_svc(self, params=None, data=None):
-        svc_caller = getattr(requests, self.REQ_METHOD)
-        response = svc_caller()
-        return response
+        """ Requests SVC_URL over the pooled connections of this thread
+
+        :param params: A mapping sent as the query string
+        :param data: A JSON serialisable object sent as the body
+        :return: A `requests.Response`
+        """
+        return get_http_session().request(
+            self.REQ_METHOD, self.SVC_URL,
+            params=params, json=data,
+            headers=self.HEADERS, timeout=self.TIMEOUT,
+        )
 
 
 class CrossrefParser(HTTPBasedParserMixin):
     """A parser that matches DOIS and retrieves metadata via Crossref API"""
     accuracy = 100
     NAME = const.CROSSREF
+    SVC_URL = "https://api.crossref.org/works"
+    # DOIs looked up per request, keeps the URL well under 2KB
+    BATCH_SIZE = 40
+    SELECT = "DOI,title,author,container-title,volume,published-online"
+    HEADERS = {"User-Agent": str(const.CROSSREF_ETIQUETTE)}
+    # Maximum concurrent requests to Crossref across all threads (books,
+    # miners and the pools below), within the polite pool's limits
+    MAX_REQUESTS = 5
+    # Maximum concurrent requests when DOIs are looked up one by one
+    LOOKUP_WORKERS = MAX_REQUESTS
+    # Rejected batches larger than this are split in two and retried
+    SPLIT_MIN_SIZE = 5
+    # Maximum concurrent batch requests of a single book
+    BATCH_WORKERS = 3
+    # Metadata (or None when not found) of the DOIs already looked up, keyed
+    # by lowercased DOI. Loaded from and appended to an on-disk log
+    WORKS_LOG = "crossref_works"
+    _works_cache = None
+    _works_cache_lock = threading.Lock()
+    _request_slots = threading.BoundedSemaphore(MAX_REQUESTS)
 
     @classmethod
     def parse_reference(cls, reference, bibtex_parser=None):
-        ret = None
-        crossref_match = const.DOI_RE.search(reference)
+        return cls.parse_references([reference])[0]
+
+    @classmethod
+    def parse_references(cls, references):
+        """ Looks up the DOIs matched on each reference in batches
+
+        :param references: A sequence of reference `str`
+        :return: A `list` with the result for each reference, in order
+        """
+        matches = cls.match_dois(references)
+
+        works_cache = cls.get_works_cache()
+        works = {}
+        pending = []
+        for doi in dict.fromkeys(matches.values()):
+            if doi.lower() in works_cache:
+                works[doi.lower()] = works_cache[doi.lower()]
+            else:
+                pending.append(doi)
+        batches = [
+            pending[i:i + cls.BATCH_SIZE]
+            for i in range(0, len(pending), cls.BATCH_SIZE)
+        ]
+        if len(batches) > 1:
+            with ThreadPoolExecutor(max_workers=cls.BATCH_WORKERS) as executor:
+                found_batches = list(executor.map(cls.fetch_works, batches))
+        else:
+            found_batches = [cls.fetch_works(batch) for batch in batches]
+        resolved = {}
+        for batch, found in zip(batches, found_batches):
+            resolved.update(found)
+            for doi in batch:
+                works[doi.lower()] = found.get(doi.lower())
+
+        # DOIs whose lookup failed are left out, to be retried next time
+        works_cache.update(resolved)
+        cache.append_log(cls.WORKS_LOG, (
+            {"doi": doi, "work": work} for doi, work in resolved.items()
+        ))
+
+        results = []
+        for reference in references:
+            doi = matches.get(reference)
+            work = works.get(doi.lower()) if doi else None
+            results.append(cls.format_work(reference, doi, work))
+        return results
+
+    @staticmethod
+    def match_dois(references):
+        """ Finds the first DOI of each reference with a single regex scan
+
+        DOIs can't contain line breaks, so matches never span references
+        :param references: A sequence of reference `str`
+        :return: A `dict` of the DOI `str` found by reference
+        """
+        # Offsets at which each reference starts in the joined text
+        starts = [0, *accumulate(len(reference) + 1 for reference in references)]
+        matches = {}
+        for match in const.DOI_RE.finditer("\n".join(references)):
+            reference = references[bisect_right(starts, match.start()) - 1]
+            matches.setdefault(reference, match.group(0))
+        return matches
 
-        if crossref_match:
-            works = Works(etiquette=const.CROSSREF_ETIQUETTE)
-            doi = works.doi(crossref_match.group(0))
+    @classmethod
+    def get(cls, url, params=None):
+        """ Sends a GET request to Crossref once one of its slots is free
+
+        Slots are only held for the duration of the request, never while
+        waiting on other requests, so nested lookups can't deadlock
+        :param url: The URL `str`
+        :param params: A `dict` of query parameters
+        :return: A `requests.Response`
+        """
+        with cls._request_slots:
+            return get_http_session().get(
+                url, params=params, headers=cls.HEADERS, timeout=cls.TIMEOUT)
+
+    @classmethod
+    def get_works_cache(cls):
+        """ Returns the metadata of the DOIs already looked up
+
+        Loaded from disk on first use, so that DOIs (found or not) are
+        never looked up again across runs
+        :return: A `dict` of metadata (or None) keyed by lowercased DOI
+        """
+        with cls._works_cache_lock:
+            if cls._works_cache is None:
+                cls._works_cache = {
+                    record["doi"]: record["work"]
+                    for record in cache.load_log(cls.WORKS_LOG)
+                }
+        return cls._works_cache
 
-            if doi:
-                ret = {'raw_reference': reference}
-                ret['doi'] = crossref_match.group(0)
+    @classmethod
+    def fetch_works(cls, dois):
+        """ Retrieves the metadata for a batch of DOIs with a single request
+
+        If Crossref rejects the batch (e.g. due to a malformed DOI), each half
+        of it is retried on its own, so that a single bad DOI only costs a
+        few more requests. Batches of up to SPLIT_MIN_SIZE DOIs fall back to
+        looking up each DOI concurrently
+        :param dois: A sequence of DOI `str`
+        :return: A `dict` of metadata keyed by lowercased DOI, None for the
+            DOIs not found. DOIs whose lookup failed are left out
+        """
+        response = cls.get(
+            cls.SVC_URL,
+            params={
+                "filter": ",".join(f"doi:{doi}" for doi in dois),
+                "select": cls.SELECT,
+                "rows": len(dois),
+            },
+        )
+        try:
+            response.raise_for_status()
+        except requests.HTTPError as e:
+            logger.warning(f"Crossref batch lookup failed: {e}")
+            if len(dois) > cls.SPLIT_MIN_SIZE:
+                middle = len(dois) // 2
+                found = cls.fetch_works(dois[:middle])
+                found.update(cls.fetch_works(dois[middle:]))
+                return found
+            with ThreadPoolExecutor(max_workers=cls.LOOKUP_WORKERS) as executor:
+                futures = {
+                    doi.lower(): executor.submit(cls.fetch_work, doi)
+                    for doi in dois
+                }
+            found = {}
+            for doi, future in futures.items():
+                try:
+                    found[doi] = future.result()
+                except requests.HTTPError as e:
+                    logger.debug(f"Crossref lookup of {doi} failed: {e}")
+            return found
+
+        found = dict.fromkeys(doi.lower() for doi in dois)
+        found.update(
+            (work["DOI"].lower(), work)
+            for work in response.json()["message"]["items"]
+        )
+        return found
 
-                ret['author'] = ''
-                if 'author' in doi:
-                    ret['author'] = ', '.join(
-                        [
-                            f'{author.get("given", "")} {author.get("family", "")}'
-                            for author in doi['author']
-                        ]
-                    )
+    @classmethod
+    def fetch_work(cls, doi):
+        """ Retrieves the metadata of a single DOI
+
+        :param doi: A DOI `str`
+        :return: The metadata `dict` or `None` if the DOI is not found
+        :raises requests.HTTPError: If the lookup fails for any other reason
+        """
+        response = cls.get(f"{cls.SVC_URL}/{quote(doi, safe='/')}")
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        # Only the fields returned by batch lookups are kept
+        work = response.json()["message"]
+        return {
+            field: work[field]
+            for field in cls.SELECT.split(",")
+            if field in work
+        }
 
-                if 'title' in doi and doi["title"]:
-                    ret['title'] = doi['title'][0]
-                else:
-                    logger.warning(f"No Title available for {crossref_match} ")
-                    return None
+    @classmethod
+    def format_work(cls, reference, doi, work):
+        if not work:
+            return None
 
+        ret = {'raw_reference': reference}
+        ret['doi'] = doi
+
+        ret['author'] = ''
+        if 'author' in work:
+            ret['author'] = ', '.join(
+                [
+                    f'{author.get("given", "")} {author.get("family", "")}'
+                    for author in work['author']
+                ]
+            )
+
+        if 'title' in work and work["title"]:
+            ret['title'] = work['title'][0]
+        else:
+            logger.warning(f"No Title available for {doi} ")
+            return None
 
-                if 'container-title' in doi and doi['container-title']:
-                    ret['journal'] = doi['container-title'][0]
+        if 'container-title' in work and work['container-title']:
+            ret['journal'] = work['container-title'][0]
 
-                if 'volume' in doi:
-                    ret['volume'] = doi['volume'][0]
+        if 'volume' in work:
+            ret['volume'] = work['volume'][0]
 
-                if 'published-online' in doi:
-                    ret['year'] = doi['published-online']['date-parts'][0][0]
+        if 'published-online' in work:
+            ret['year'] = work['published-online']['date-parts'][0][0]
 
-        return ret
+        return ParseResult.from_dict(ret)
 
 
 class BloomsburyAcademicParser(BaseReferenceParser):
     accuracy = 75
     NAME = const.BLOOMSBURY_ACADEMIC
+    PARALLEL_THRESHOLD = 5000
+    BOOK_RE = re.compile(
+        r'‘(<i>)*(.+?)(<\/i>)*(<\/span>)*’, in', re.DOTALL)
+    JOURNAL_ATITLE_RE = re.compile(r'atitle=(.+?)&', re.DOTALL)
+    JOURNAL_QUOTED_RE = re.compile(r'‘(.+?)’', re.DOTALL)
+    # Classes of the spans read from a reference and from each of its people
+    FIELD_CLASSES = frozenset(
+        ("author", "editor", "pubdate", "italic", "volumenum"))
+    NAME_CLASSES = frozenset(("firstname", "surname"))
 
-
+    @classmethod
+    @memoize_parse
     def parse_reference(cls, reference):
-        # create a soup version of the reference
-        souped = BeautifulSoup(reference, 'html.parser')
+        # parse the reference as an HTML fragment
+        root = lxml_html.fragment_fromstring(reference, create_parent=True)
+        spans = _spans_by_class(root, cls.FIELD_CLASSES)
         formatted_reference = {}
 
         # authors (and editors)
         authors = []
-        for soup_author in souped.find_all('span', {'class': 'author'}):
-            try:
-                authors.append(f'{soup_author.find("span", {"class":"firstname"}).get_text()} '
-                               f'{soup_author.find("span", {"class":"surname"}).get_text()}')
-            except:
-                pass
-        for soup_author in souped.find_all('span', {'class': 'editor'}):
-            try:
-                authors.append(f'{soup_author.find("span", {"class":"firstname"}).get_text()} '
-                               f'{soup_author.find("span", {"class":"surname"}).get_text()}')
-            except:
-                pass
+        for person in chain(spans["author"], spans["editor"]):
+            names = _spans_by_class(person, cls.NAME_CLASSES)
+            if names["firstname"] and names["surname"]:
+                authors.append(
+                    f'{_text(names["firstname"][0])} '
+                    f'{_text(names["surname"][0])}'
+                )
         formatted_reference['author'] = ' ,'.join(authors)
 
         # year
-        try:
-            formatted_reference['year'] = souped.find('span', {'class': 'pubdate'}).get_text()
-        except:
-            formatted_reference['year'] = ''
+        pubdate = spans["pubdate"]
+        formatted_reference['year'] = _text(pubdate[0]) if pubdate else ''
 
         # we initially populate title and journal with the same field
-        try:
-            formatted_reference['title'] = souped.find('span', {'class': 'italic'}).get_text()
-            formatted_reference['journal'] = souped.find('span', {'class': 'italic'}).get_text()
-        except:
-            formatted_reference['title'] = ''
-            formatted_reference['journal'] = ''
+        italic = spans["italic"]
+        italic_text = _text(italic[0]) if italic else ''
+        formatted_reference['title'] = italic_text
+        formatted_reference['journal'] = italic_text
 
         # volume
-        try:
-            formatted_reference['volume'] = souped.find('span', {'class': 'volumenum'}).get_text()
-        except:
-            formatted_reference['volume'] = ''
+        volume = spans["volumenum"]
+        formatted_reference['volume'] = _text(volume[0]) if volume else ''
 
         # determine the type of entry
         # if it contains ", in", it's a book chapter
-        book_regex = re.compile(r'‘(<i>)*(.+?)(<\/i>)*(<\/span>)*’, in', re.MULTILINE | re.DOTALL)
-        match = book_regex.search(reference)
+        # The lazy patterns rescan the rest of the reference from every
+        # candidate start when they fail, so they only run when their
+        # literal parts are present
+        match = None
+        if '’, in' in reference:
+            match = cls.BOOK_RE.search(reference)
         is_book = False
         if match:
             is_book = True
@@ -207,66 +745,79 @@ class BloomsburyAcademicParser(BaseReferenceParser):
 
         if not is_book:
             # journal articles
-            journal_regex = re.compile(r'atitle=(.+?)&', re.MULTILINE | re.DOTALL)
-            match = journal_regex.search(reference)
+            match = None
+            if 'atitle=' in reference:
+                match = cls.JOURNAL_ATITLE_RE.search(reference)
             if match and not '&amp;aulast' in match.group(1):
                 formatted_reference['title'] = match.group(1)
-            else:
-                journal_regex = re.compile(r'‘(.+?)’', re.MULTILINE | re.DOTALL)
-                match = journal_regex.search(reference)
+            elif '‘' in reference:
+                match = cls.JOURNAL_QUOTED_RE.search(reference)
                 if match:
                     formatted_reference['title'] = match.group(1)
-        return formatted_reference
+        return ParseResult.from_dict(formatted_reference)
+
+
+def _text(element):
+    return "".join(element.itertext())
+
+
+def _spans_by_class(element, classes):
+    """ Collects the spans below an element in a single walk of its subtree
+    :param element: An `lxml.etree._Element`
+    :param classes: The classes of interest
+    :return: A `defaultdict` of the spans (in document order) by class
+    """
+    found = defaultdict(list)
+    for span in element.iter("span"):
+        for class_name in (span.get("class") or "").split():
+            if class_name in classes:
+                found[class_name].append(span)
+    return found
 
 
 class CambridgeCoreParser(BaseReferenceParser):
     accuracy = 85
     NAME = const.CAMBRIDGE_CORE
 
+    @classmethod
+    @memoize_parse
     def parse_reference(cls, reference):
         try:
-            reference_json = json.loads(reference)
-        except json.decoder.JSONDecodeError:
+            content = orjson.loads(reference)['atom:content']
+        except orjson.JSONDecodeError:
             logger.warning(f"Not valid JSON reference: {reference}")
             return None
 
         formatted_reference = {}
 
         # year
-        formatted_reference['year'] = reference_json['atom:content']['m:pub-year']
+        formatted_reference['year'] = content['m:pub-year']
 
         # title
-        if reference_json['atom:content']['m:title'] is not None \
-                and reference_json['atom:content']['m:title'] != '':
-            formatted_reference['title'] = reference_json['atom:content']['m:title']
-        elif reference_json['atom:content']['m:book-title'] is not None \
-                and reference_json['atom:content']['m:book-title'] != '':
-            formatted_reference['title'] = reference_json['atom:content']['m:book-title']
+        title = content['m:title'] or content['m:book-title']
+        if title:
+            formatted_reference['title'] = title
 
         # log the raw reference
-        formatted_reference['raw_reference'] = reference_json['atom:content']['m:display']
+        formatted_reference['raw_reference'] = content['m:display']
 
         # journal
-        if reference_json['atom:content']['m:journal-title'] != '' \
-                and reference_json['atom:content']['m:journal-title'] is not None:
-            formatted_reference['journal'] = reference_json['atom:content']['m:journal-title']
+        if content['m:journal-title']:
+            formatted_reference['journal'] = content['m:journal-title']
 
         # authors
-        formatted_reference['author'] = ''
-        for author in reference_json['atom:content']['m:authors']:
-            formatted_reference['author'] += f'{author["content"]}, '
+        formatted_reference['author'] = ''.join(
+            f'{author["content"]}, ' for author in content['m:authors'])
 
         # DOI where it exists
-        if reference_json['atom:content']['m:dois'] is not None \
-                and len(reference_json['atom:content']['m:dois']) > 0 \
-                and reference_json['atom:content']['m:dois'][0]['content'] != '':
-            formatted_reference['doi'] = reference_json['atom:content']['m:dois'][0]['content']
+        dois = content['m:dois']
+        if dois and dois[0]['content']:
+            formatted_reference['doi'] = dois[0]['content']
 
         # volume
-        if reference_json['atom:content']['m:journal-volume'] != '' and \
-                reference_json['atom:content']['m:journal-volume'] is not None:
-            formatted_reference['volume'] = reference_json['atom:content']['m:journal-volume']
+        if content['m:journal-volume']:
+            formatted_reference['volume'] = content['m:journal-volume']
 
         formatted_reference['parser'] = cls.NAME
 
-        return formatted_reference
+        return ParseResult.from_dict(formatted_reference)
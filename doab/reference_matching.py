@@ -1,8 +1,13 @@
-from itertools import chain
+from collections import defaultdict
+import hashlib
 import logging
 import re
-from functools import singledispatch
+import sys
+from functools import lru_cache, singledispatch
 
+from sqlalchemy import Float, and_, bindparam, cast, func, literal, null, or_
+from sqlalchemy.ext import baked
+from sqlalchemy.orm import selectinload
 from sqlalchemy.orm.exc import NoResultFound
 
 from doab import const
@@ -10,121 +15,341 @@ from doab.db import models, session_context
 
 logger = logging.getLogger(__name__)
 
+WORD_RE = re.compile(r'\w+')
+# Rows fetched at a time from the server side cursor when matching
+YIELD_PER = 100
+# Number of match results kept by match_reference_ids
+MATCH_CACHE_SIZE = 50000
+_matched_ids_cache = {}
+# Tags identifying the matcher that found each parse
+DOI_MATCHER = "doi"
+TITLE_MATCHER = "title"
+# Caches the compiled matching queries, so they are only built once
+_bakery = baked.bakery()
+
 
 @singledispatch
 def match(reference, session, return_references=False, book_ids=None):
-    matches = []
-    for matcher in MATCHERS:
-        matched = matcher(reference, session, book_ids)
-        if return_references:
-            matches += matched.keys()
-        else:
-            matches += chain.from_iterable(matched.values())
-    return matches
+    """ Yields the books (or reference ids) matching the given reference
+
+    Results are lazily loaded, so they must be consumed before the session
+    is closed
+    """
+    matched = match_parses(
+        reference, session, book_ids, load_books=not return_references)
+    if return_references:
+        yield from matched.keys()
+    else:
+        for parse in matched.values():
+            yield from parse.reference.books
 
 @match.register(models.ParsedReference)
 def match_parsed_reference(reference, *args, **kwargs):
-    d = {
-        "title": reference.title,
-        "doi": reference.doi,
-        "author": reference.authors,
+    return match(parse_fields(reference), *args, **kwargs)
+
+
+def parse_fields(parse):
+    """ Maps a `models.ParsedReference` to the fields used for matching """
+    return {
+        "title": parse.title,
+        "doi": parse.doi,
+        "author": parse.authors,
     }
-    return match(d, *args, **kwargs)
 
 
-def match_by_doi(reference, session, book_ids=None):
-    if "doi" not in reference or reference["doi"] is None:
-        return {}
+def match_batch(references, session, book_ids=None, load_books=False):
+    """ Finds the parses matching each of the given references
 
-    parses_matching = session.query(
-            models.ParsedReference
-        ).filter(
-            models.ParsedReference.doi == reference["doi"],
-        )
-    if book_ids:
-        parses_matching = parses_matching.join(
-            models.Reference
-        ).filter(
-            models.Reference.books.any(models.Book.doab_id.in_(book_ids))
-        )
-    return {p.reference_id: p.reference.books for p in parses_matching}
+    The DOIs of all the references are looked up with a single query. Only
+    the references without a DOI match have their titles searched
+    :param references: A sequence of `dict` with the "title", "doi" and
+        "author" to match
+    :param session: A SQLAlchemy session
+    :param book_ids: Only match parses of references from these books
+    :param load_books: Eagerly load the books of the matched references
+    :return: A `list` with the matches of each reference, in order, as
+        returned by `match_parses`
+    """
+    dois = {reference.get("doi") for reference in references} - {None}
+    matches_by_doi = defaultdict(dict)
+    if dois:
+        shape = (bool(book_ids), load_books)
+        parses_matching = _bakery(
+            lambda s: _match_dois_query(s, *shape), *shape)
+        params = {"dois": list(dois)}
+        if book_ids:
+            params["book_ids"] = list(book_ids)
+        for parse in parses_matching(session).params(
+            **params
+        ).with_post_criteria(lambda q: q.yield_per(YIELD_PER)):
+            matches_by_doi[parse.doi][parse.reference_id] = parse
 
+    results = []
+    for reference in references:
+        matches = matches_by_doi.get(reference.get("doi"))
+        if not matches:
+            matches = match_parses(
+                dict(reference, doi=None), session, book_ids, load_books)
+        results.append(matches)
+    return results
 
-def match_title_exact(reference, session, book_ids=None):
-    if "title" not in reference or reference["title"] is None:
-        return {}
-    parses_matching = session.query(
-        models.ParsedReference,
+
+def _match_dois_query(session, by_books, load_books):
+    """ Builds the query of the parses with any of the "dois" parameter
+
+    :param session: A SQLAlchemy session
+    :param by_books: Only match parses from the books in "book_ids"
+    :param load_books: Eagerly load the books of the matched references
+    :return: A SQLAlchemy `Query`
+    """
+    parses_matching = _query_parses(
+        session, by_books,
     ).filter(
-        models.ParsedReference.title == reference["title"],
+        models.ParsedReference.doi.in_(bindparam("dois", expanding=True)),
     )
-    if book_ids:
-        parses_matching = parses_matching.join(
-            models.Reference
-        ).filter(
-            models.Reference.books.any(models.Book.doab_id.in_(book_ids))
+    if load_books:
+        parses_matching = _load_books(parses_matching)
+    return parses_matching
+
+
+def match_reference_ids(references, session, book_ids=None):
+    """ Memoized `match_batch` returning only the ids of the references matched
+
+    Results are cached in process by the matched fields, so they assume that
+    parses aren't added while matching
+    :param references: A sequence of `dict` with the "title", "doi" and
+        "author" to match
+    :param session: A SQLAlchemy session
+    :param book_ids: Only match parses of references from these books
+    :return: A `list` with a `frozenset` of reference ids per reference
+    """
+    keys = [_match_key(reference, book_ids) for reference in references]
+    found = {}
+    pending = {}
+    for key, reference in zip(keys, references):
+        if key in _matched_ids_cache:
+            found[key] = _matched_ids_cache[key]
+        else:
+            pending[key] = reference
+    if pending:
+        matched = match_batch(list(pending.values()), session, book_ids)
+        found.update(
+            (key, frozenset(matches))
+            for key, matches in zip(pending, matched)
         )
-    return {p.reference_id: p.reference.books for p in parses_matching}
+        if len(_matched_ids_cache) > MATCH_CACHE_SIZE:
+            _matched_ids_cache.clear()
+        _matched_ids_cache.update(found)
+    return [found[key] for key in keys]
 
 
-def match_fuzzy(reference, session, book_ids=None):
+def _match_key(reference, book_ids):
+    fields = (
+        reference.get("doi"),
+        reference.get("title"),
+        reference.get("author"),
+        tuple(sorted(book_ids)) if book_ids else None,
+    )
+    return hashlib.blake2b(repr(fields).encode("utf-8"), digest_size=16).digest()
+
+
+def match_parses(reference, session, book_ids=None, load_books=False):
+    """ Finds the parses matching the given reference in a single round-trip
+
+    A parse sharing the same DOI is an authoritative match, so the title is
+    only searched when there is none. Parses match when they have the same
+    title (ignoring case), or a similar one (pg_trgm) that is close enough or
+    whose authors also match. Each row is tagged with the matcher that found
+    it
+    :param reference: A `dict` with the "title", "doi" and "author" to match
+    :param session: A SQLAlchemy session
+    :param book_ids: Only match parses of references from these books
+    :param load_books: Eagerly load the books of the matched references
+    :return: A `dict` mapping the matched reference ids to a matching parse
+    """
+    doi = reference.get("doi")
     title = reference.get("title")
     authors = reference.get("author", "")
-    if "title" not in reference or reference["title"] is None:
+    if doi is None and title is None:
         return {}
 
-    # Fuzzy text search on title against db
-    title = reference["title"]
-    match_term = f"%{title}%"
-    parses_matching = session.query(
-        models.ParsedReference,
-        models.ParsedReference.title.op('<->')(title),
-    ).filter(
-        models.ParsedReference.title.op("%%")(title),
+    # The authors are the same for every candidate parse
+    initials, names = _split_names_initials(authors)
+    with_authors = bool(initials or names)
+    # The query is baked once for each combination of the fields given
+    shape = (
+        doi is not None, title is not None, with_authors, bool(book_ids),
+        load_books,
     )
+    parses_matching = _bakery(lambda s: _match_parses_query(s, *shape), *shape)
+    params = {}
+    if doi is not None:
+        params["doi"] = doi
+    if title is not None:
+        params.update(
+            title=title,
+            min_length=len(title) * const.MIN_TITLE_LENGTH_RATIO,
+            max_length=len(title) / const.MIN_TITLE_LENGTH_RATIO,
+        )
+        if with_authors:
+            # Words are only made of \w characters, which need no escaping
+            params["author_initials"] = "\\m[{}]".format(
+                "".join({word[0] for word in names | initials}))
+        else:
+            length_ratio = 1 - const.MIN_TITLE_THRESHOLD
+            params.update(
+                min_close_length=len(title) * length_ratio,
+                max_close_length=len(title) / length_ratio,
+            )
     if book_ids:
-        parses_matching = parses_matching.join(
-            models.Reference
+        params["book_ids"] = list(book_ids)
+
+    matches = {}
+    for parse, matcher, distance in parses_matching(session).params(
+        **params
+    ).with_post_criteria(lambda q: q.yield_per(YIELD_PER)):
+        if matcher == DOI_MATCHER:
+            logger.debug(f"DOI match: {doi}")
+        elif parse.title.lower() == title.lower():
+            logger.debug(f"Exact title match: {title}")
+        else:
+            # Only matched on title similarity, refine with authors
+            logger.debug(f"Match distance {distance}: '{title} || {parse.title}'")
+            if not (
+                (distance <= const.MIN_TITLE_THRESHOLD)
+                or match_authors_fuzzy(initials, names, parse)
+            ):
+                continue
+        matches[parse.reference_id] = parse
+
+    return matches
+
+
+def _match_parses_query(
+    session, by_doi, by_title, with_authors, by_books, load_books,
+):
+    """ Builds the query of `match_parses` with bound parameters
+
+    :param session: A SQLAlchemy session
+    :param by_doi: Match parses by the "doi" parameter
+    :param by_title: Match parses by the "title" parameter, whose length
+        bounds are given by the "min_length" and "max_length" parameters
+        (and "min_close_length" and "max_close_length" without authors)
+    :param with_authors: The matched authors can refine the title matches,
+        given a regex of their initials in the "author_initials" parameter
+    :param by_books: Only match parses from the books in "book_ids"
+    :param load_books: Eagerly load the books of the matched references
+    :return: A SQLAlchemy `Query`
+    """
+    title = bindparam("title")
+    # Case insensitive, like trigrams are, so it can use its own index
+    same_title = func.lower(models.ParsedReference.title) == func.lower(title)
+    queries = []
+    if by_doi:
+        doi_parses = _query_parses(
+            session, by_books,
+            literal(DOI_MATCHER), cast(null(), Float),
         ).filter(
-            models.Reference.books.any(models.Book.doab_id.in_(book_ids))
+            models.ParsedReference.doi == bindparam("doi"),
         )
+        queries.append(doi_parses)
+    if by_title:
+        title_parses = _query_parses(
+            session, by_books,
+            literal(TITLE_MATCHER), models.ParsedReference.title.op('<->')(title),
+        ).filter(
+            func.length(models.ParsedReference.title).between(
+                bindparam("min_length"), bindparam("max_length"),
+            ),
+            or_(
+                same_title,
+                models.ParsedReference.title.op("%%")(title),
+            ),
+        )
+        if with_authors:
+            # Similar titles that aren't close enough can only match on
+            # authors, so at least one of their words must start like a word
+            # of the given authors (in any case). The rest are never sent back
+            title_parses = title_parses.filter(or_(
+                same_title,
+                models.ParsedReference.title.op('<->')(title)
+                <= const.MIN_TITLE_THRESHOLD,
+                models.ParsedReference.authors.op('~*')(
+                    bindparam("author_initials")),
+            ))
+        else:
+            # Without authors, similar titles can only match when they are
+            # close enough, so the rest are never sent back. Their length
+            # is bound by the same threshold and is cheaper to check first
+            title_parses = title_parses.filter(or_(
+                same_title,
+                and_(
+                    func.length(models.ParsedReference.title).between(
+                        bindparam("min_close_length"),
+                        bindparam("max_close_length"),
+                    ),
+                    models.ParsedReference.title.op('<->')(title)
+                    <= const.MIN_TITLE_THRESHOLD,
+                ),
+            ))
+        if by_doi:
+            # Evaluated once by postgres, the title isn't searched at all
+            # when the DOI matched
+            title_parses = title_parses.filter(~doi_parses.exists())
+        queries.append(title_parses)
 
-    #refine with autors
-    matches = []
-    for parse, distance in parses_matching:
-        logger.debug(f"Match distance {distance}: '{title} || {parse.title}'")
-        if (
-            (distance <= const.MIN_TITLE_THRESHOLD)
-            or match_authors_fuzzy(authors, parse)
-        ):
-            matches.append(parse)
+    parses_matching = queries[0].union_all(*queries[1:])
+    if load_books:
+        parses_matching = _load_books(parses_matching)
+    return parses_matching
 
 
-    return {p.reference_id: p.reference.books for p in matches}
+def _load_books(query):
+    return query.options(
+        selectinload(
+            models.ParsedReference.reference
+        ).selectinload(models.Reference.books)
+    )
 
-def match_authors_fuzzy(authors, parse):
+
+def _query_parses(session, by_books, *columns):
+    """ Queries parses, from the books in the "book_ids" parameter if given """
+    query = session.query(models.ParsedReference, *columns)
+    if by_books:
+        query = query.join(
+            models.Reference
+        ).filter(
+            models.Reference.books.any(models.Book.doab_id.in_(
+                bindparam("book_ids", expanding=True)))
+        )
+    return query
+
+def match_authors_fuzzy(initials, names, parse):
     """Determines if the authors from a parse match the given authors
 
     Authors are parsed from a citation as a comma/space separated string.
     Since there is no effective way of splitting the author string into
     individual authors, we intersect a set containing the names in each author
     string and determine the match based on arbitrary similarity weight
+    :param initials: The initials in the authors, from `_split_names_initials`
+    :param names: The names in the authors, from `_split_names_initials`
+    :param parse: The `ParsedReference` to match
+    :return: `True` if the authors match
     """
-    if not (authors and parse.authors):
+    if not ((initials or names) and parse.authors):
         logger.debug("No authors available for matching")
         return False
 
-    matched_names = set()
-    initials, names = _split_names_initials(authors)
     parse_initials, parse_names = _split_names_initials(parse.authors)
 
-    matched_names &= (names & parse_names)
+    matched_names = names & parse_names
 
     # Add the initials of the remaining names to the sets containing initials
-    parse_initials &= (parse_names - names)
-    initials &= (names - parse_names)
+    remaining_parse_initials = parse_initials | {
+        name[0] for name in parse_names - names}
+    remaining_initials = initials | {name[0] for name in names - parse_names}
 
-    matched_names &= (initials & parse_initials)
+    matched_names |= (remaining_initials & remaining_parse_initials)
     logger.debug(f"Matched names: {matched_names}")
 
     try:
@@ -134,18 +359,16 @@ def match_authors_fuzzy(authors, parse):
         )
     except ZeroDivisionError:
         return False
-    logger.debug(f"Authors match: {matched} ({authors} || {parse.authors})")
+    logger.debug(f"Authors match: {matched} ({names|initials} || {parse.authors})")
     return matched
 
+@lru_cache(maxsize=16384)
 def _split_names_initials(authors):
-    author_names = set(re.compile(r'\w+').findall(authors))
+    # Results are cached, so they are returned as immutable sets. Interned
+    # words are compared by identity when the sets are intersected
+    if not authors:
+        return frozenset(), frozenset()
     initials, names = set(), set()
-    for word in author_names:
-        names.add(word.lower()) if len(word) > 1 else initials.add(word.lower())
-    return initials, names
-
-MATCHERS = [
-    match_by_doi,
-    match_title_exact,
-    match_fuzzy,
-]
+    for word in WORD_RE.findall(authors.lower()):
+        (names if len(word) > 1 else initials).add(sys.intern(word))
+    return frozenset(initials), frozenset(names)
@@ -1,20 +1,50 @@
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Maximum items submitted to the pool (running or queued) per worker
+MAX_PENDING_PER_WORKER = 2
+
 
 def run(task, items, msg, workers, *args, **kwargs):
+    """ Runs the task for each of the items, on a pool of threads if workers
+
+    :param workers: The number of threads, items run sequentially if 0
+    :return: A list with the result for each item, in order. With workers,
+        the items whose task raised are logged and their result is None
+    """
     total_items = len(items)
-    executor = ThreadPoolExecutor(max_workers=workers or 1)
+    log_msgs = [
+        f"[task:{item_no}/{total_items}] {msg} {item}"
+        for item_no, item in enumerate(items)
+    ]
+    if not workers:
+        return [
+            task_wrapper(task, log_msg, item, *args, **kwargs)
+            for log_msg, item in zip(log_msgs, items)
+        ]
+
+    # Items are submitted as others finish, so that only a few are queued
+    # per worker no matter how many items there are
+    max_pending = workers * MAX_PENDING_PER_WORKER
+    futures = []
+    pending = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for log_msg, item in zip(log_msgs, items):
+            if len(pending) >= max_pending:
+                _, pending = wait(pending, return_when=FIRST_COMPLETED)
+            future = executor.submit(
+                task_wrapper, task, log_msg, item, *args, **kwargs)
+            futures.append(future)
+            pending.add(future)
     results = []
-    for item_no, item in enumerate(items):
-        log_msg = f"[task:{item_no}/{total_items}] {msg} {item}"
-        if workers:
-            executor.submit(task_wrapper, task, log_msg, item, *args, **kwargs)
-        else:
-            result = task_wrapper(task, log_msg, item, *args, **kwargs)
-            results.append(result)
+    for item, future in zip(items, futures):
+        try:
+            results.append(future.result())
+        except Exception:
+            logger.exception(f"{msg} {item} failed")
+            results.append(None)
     return results
 
 
@@ -1,5 +1,8 @@
+import logging
+
 from doab.tests import acceptance_tests
 from doab.tests.test_types import TestManager
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     TestManager.test()
@@ -20,7 +20,7 @@ class PalgraveAcceptanceTestA(IntersectAcceptanceTest):
 @TestManager.register
 class PalgraveAcceptanceTestB(IntersectAcceptanceTest):
     CITATION = "Ackers, H. L., Ioannou, E., & Ackers-Johnson, J. (2016). The impact of delays on maternal and neonatal outcomes in Ugandan public health facilities: The role of absenteeism. Health Policy and Planning, 1–10. doi:10.1093/heapol/czw046."
-    BOOK_IDS = {"21612", "20717", "21612"}
+    BOOK_IDS = {"21612", "20717"}
 
 
 @TestManager.register
@@ -1,23 +1,53 @@
+from collections import defaultdict
+import logging
 import sys
 from tempfile import TemporaryFile
 
+from doab import tasker
 from doab.commands import db_populator, parse_references, match_reference, list_references
 from doab.const import DEFAULT_OUT_DIR
 
+logger = logging.getLogger(__name__)
+
 
 class TestManager(object):
     TEST_CASES = []
+    # Tests only query the database once it is populated, so they run
+    # concurrently, each thread with its own session
+    WORKERS = 4
 
     @classmethod
     def register(cls, test_case):
         cls.TEST_CASES.append(test_case)
-        return cls
+        return test_case
 
     @classmethod
     def test(cls):
+        # Books shared by several tests are only populated and parsed once
+        book_ids = defaultdict(set)
         for Test in cls.TEST_CASES:
-            test = Test()
-            test.run()
+            book_ids[Test.INPUT_PATH] |= set(Test.get_book_ids())
+        for input_path, ids in book_ids.items():
+            logger.info(f"Populating and parsing {len(ids)} books")
+            db_populator(input_path, sorted(ids))
+            parse_references(input_path, sorted(ids))
+
+        results = tasker.run(
+            cls.run_test, cls.TEST_CASES, "Running", cls.WORKERS)
+        failures = [
+            Test for Test, passed in zip(cls.TEST_CASES, results)
+            if not passed
+        ]
+        if failures:
+            logger.error(f"{len(failures)} tests failed: {failures}")
+            sys.exit(1)
+
+    @staticmethod
+    def run_test(Test):
+        """ Runs a test case
+        :return: True if the test passed
+        """
+        return Test().run()
 
     def __new__(*args, **kwargs):
         raise NotImplementedError
@@ -35,30 +65,39 @@ class IntersectAcceptanceTest(object):
     INPUT_PATH = DEFAULT_OUT_DIR
 
     def __init__(self):
-        print(f"Starting test {self}")
-        print(f"Input citation: '{self.CITATION}")
-        print(f"Expected book IDS: {self.BOOK_IDS}")
-        print("Processing...")
-        db_populator(self.INPUT_PATH, self.BOOK_IDS)
-        parse_references(self.INPUT_PATH, self.BOOK_IDS)
+        logger.info(f"Starting test {self}")
+
+    @classmethod
+    def get_book_ids(cls):
+        """ The books to be populated and parsed before the test runs"""
+        return cls.BOOK_IDS
 
     def __str__(self):
         return str(self.__class__.__name__)
 
     def assert_references_matched(self):
+        """ Matches the citation against the parsed references
+        :return: True if all the expected books were matched
+        """
         expected = {id_ for id_ in self.BOOK_IDS}
         result = set(match_reference(self.CITATION).keys())
-        print(f"Matched book IDS: {result}")
         failures = expected - result
+        # Each test logs a single record, so that the output of tests
+        # running concurrently isn't interleaved
+        report = (
+            f"{self}\n"
+            f"Input citation: '{self.CITATION}'\n"
+            f"Expected book IDS: {self.BOOK_IDS}\n"
+            f"Matched book IDS: {result}\n"
+        )
         if failures:
-            sys.stderr.write(f"[FAILED] Missed book ids: {failures}\n")
-            sys.stderr.flush()
-            sys.exit(1)
-        else:
-            print("[SUCCESS]")
+            logger.error(f"{report}[FAILED] Missed book ids: {failures}")
+            return False
+        logger.info(f"{report}[SUCCESS]")
+        return True
 
     def run(self):
-        self.assert_references_matched()
+        return self.assert_references_matched()
 
 
 class ReferenceParsingTest(object):
@@ -68,18 +107,24 @@ class ReferenceParsingTest(object):
     INPUT_PATH = DEFAULT_OUT_DIR
 
     def __init__(self, *args, **kwargs):
-        print(f"Starting Parse test for {self.PUBLISHER_NAME}")
-        print("Processing...")
-        book_ids = self.BOOK_REFERENCE_COUNTS.keys()
-        db_populator(self.INPUT_PATH, book_ids)
-        parse_references(self.INPUT_PATH, book_ids)
+        logger.info(f"Starting Parse test for {self.PUBLISHER_NAME}")
+
+    @classmethod
+    def get_book_ids(cls):
+        """ The books to be populated and parsed before the test runs"""
+        return cls.BOOK_REFERENCE_COUNTS.keys()
 
     def assert_references_parsed(self):
-        print("BOOK   EXP  MINED")
-        print("=================")
+        """ Reports the references mined against those expected per book
+        :return: True, counts are reported rather than asserted
+        """
+        lines = [self.PUBLISHER_NAME, "BOOK   EXP  MINED", "================="]
         for book_id, expected in self.BOOK_REFERENCE_COUNTS.items():
-            print(book_id, expected, len(list_references(book_id)))
+            lines.append(
+                f"{book_id} {expected} {len(list_references(book_id))}")
+        logger.info("\n".join(lines))
+        return True
 
     def run(self):
-        self.assert_references_parsed()
+        return self.assert_references_parsed()
 
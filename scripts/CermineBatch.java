@@ -0,0 +1,40 @@
+import java.io.BufferedReader;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.nio.charset.StandardCharsets;
+
+import pl.edu.icm.cermine.bibref.CRFBibReferenceParser;
+import pl.edu.icm.cermine.bibref.model.BibEntry;
+
+/**
+ * Parses references read from stdin, one per line, with a single JVM
+ *
+ * Run from the cermine wrapper as a single-file source program:
+ *     cermine /usr/local/bin/CermineBatch.java
+ * Each reference is printed in BibTeX followed by a line with "%%", and
+ * stdout is flushed so that callers can stream references one at a time.
+ * Nothing but the separator is printed for references that can't be parsed.
+ * The program exits when stdin is closed.
+ */
+public class CermineBatch {
+
+    static final String SEPARATOR = "%%";
+
+    public static void main(String[] args) throws Exception {
+        CRFBibReferenceParser parser = CRFBibReferenceParser.getInstance();
+        BufferedReader in = new BufferedReader(
+            new InputStreamReader(System.in, StandardCharsets.UTF_8));
+        PrintStream out = new PrintStream(System.out, false, "UTF-8");
+        String reference;
+        while ((reference = in.readLine()) != null) {
+            try {
+                BibEntry entry = parser.parseBibReference(reference);
+                out.println(entry.toBibTeX());
+            } catch (Exception e) {
+                System.err.println("Unable to parse " + reference + ": " + e);
+            }
+            out.println(SEPARATOR);
+            out.flush();
+        }
+    }
+}
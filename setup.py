@@ -21,12 +21,13 @@ setuptools.setup(
         "unidecode",
         "bibtexparser",
         "bs4",
-        "ebooklib",
+        "lxml",
         "alembic",
         "colorlog",
         "doi2bib",
         "docopt",
-        "crossrefapi"
+        "crossrefapi",
+        "orjson",
     ],
     classifiers=[
         "Programming Language :: Python :: 3",